@@ -1,21 +1,224 @@
 var loadData = require('./lib/data');
+var inflate = require('./lib/inflate');
+var raf = require('raf');
 var init = false;
 var frame = 0;
 var frames = [];
 var timerID = 0;
+var index = null;
+var chunks = [];
+var decoded = [];
+var loaded = 0;
+var waiting = false;
 
-function decompress(cb) {
-  var frag = document.querySelector('script[type="text/tmux-data"]');
-  if (!frag) {
+function loadChunk() {
+  // Adds the next chunk to the frames, inflating it now if it isn't ready.
+  if (loaded >= chunks.length) {
+    return false;
+  }
+  var data = decoded[loaded];
+  if (typeof data !== 'string') {
+    data = loadData(chunks[loaded]);
+  }
+  frames.push.apply(frames, JSON.parse(data));
+  chunks[loaded] = decoded[loaded] = null;
+  loaded++;
+  return true;
+}
+
+function decompress(cb, more) {
+  // All chunks are inflated at once and added in order as they're ready, so
+  // playback starts as soon as the first chunk is.  `more` is called when
+  // frames are added after that.
+  var hunks = document.querySelectorAll('script[type="text/tmux-data"]');
+  for (var i = 0; i < hunks.length; i++) {
+    chunks.push(hunks[i].textContent || hunks[i].innerText);
+    hunks[i].parentNode.removeChild(hunks[i]);
+  }
+
+  chunks.forEach(function(text, i) {
+    inflate(text, function(data) {
+      if (i < loaded) {
+        return;
+      }
+      decoded[i] = data;
+      while (typeof decoded[loaded] === 'string') {
+        loadChunk();
+      }
+      if (init) {
+        more();
+      } else if (frames.length) {
+        init = true;
+        cb();
+      }
+    });
+  });
+}
+
+function postings(token) {
+  // Tokens map to flat [frame, pane, row, ...] lists with frames stored as
+  // the difference from the previous frame.  They're decoded when used.
+  if (index === null) {
+    var frag = document.querySelector('script[type="text/tmux-index"]');
+    index = frag ? JSON.parse(loadData(frag.textContent || frag.innerText)) : {};
+  }
+  var flat = index[token];
+  if (!flat) {
+    return [];
+  }
+  if (typeof flat[0] === 'number') {
+    var out = [];
+    var n = 0;
+    for (var i = 0; i < flat.length; i += 3) {
+      n += flat[i];
+      out.push({frame: n, pane: flat[i + 1], row: flat[i + 2]});
+    }
+    index[token] = flat = out;
+  }
+  return flat;
+}
+
+var panes = {};
+var pending = [];
+var cursors = {};
+var scheduled = false;
+var template = document.createElement('template');
+
+function parse(html) {
+  // Parses markup with a reused template element.
+  template.innerHTML = html;
+  return template.content;
+}
+
+function getPane(id) {
+  // Panes and their rows are looked up once per layout.
+  var p = panes[id];
+  if (p === undefined) {
+    var el = document.getElementById('p' + id);
+    var pre = el ? el.querySelector('pre') : null;
+    p = panes[id] = pre ? {el: el, pre: pre, cursor: null,
+                           rows: Array.prototype.slice.call(pre.children)} : null;
+  }
+  return p;
+}
+
+function moveCursor(p, pos) {
+  // The cursor is an overlay so rows don't change when it moves.
+  if (!p.cursor) {
+    p.cursor = document.createElement('div');
+    p.cursor.className = 'cursor';
+    p.el.appendChild(p.cursor);
+  }
+  var row = p.rows[pos[1]];
+  if (pos[0] < 0 || !row) {
+    p.cursor.style.display = 'none';
     return;
   }
-  frames.push.apply(frames, JSON.parse(loadData(frag.textContent || frag.innerText)));
-  frag.parentNode.removeChild(frag);
-  if (!init) {
-    init = true;
-    cb();
+  var width = row.offsetWidth / parseInt(p.el.dataset.w, 10);
+  p.cursor.style.display = 'block';
+  p.cursor.style.left = (p.pre.offsetLeft + row.offsetLeft + pos[0] * width) + 'px';
+  p.cursor.style.top = (p.pre.offsetTop + row.offsetTop) + 'px';
+  p.cursor.style.width = width + 'px';
+  p.cursor.style.height = row.offsetHeight + 'px';
+}
+
+function applyFrame(fr) {
+  if (fr.reset) {
+    document.querySelector('.$prefix').innerHTML = fr.layout;
+    panes = {};
+    cursors = {};
+    return;
+  }
+
+  if (fr.scroll) {
+    for (var id in fr.scroll) {
+      var p = getPane(id);
+      if (!p) {
+        continue;
+      }
+      // Move rows instead of repainting them: [top, bottom, rows]
+      var s = fr.scroll[id];
+      var rows = p.rows;
+      if (s[2] > 0) {
+        for (var i = 0; i < s[2]; i++) {
+          p.pre.insertBefore(rows[s[0]], rows[s[1]].nextSibling);
+          rows.splice(s[1], 0, rows.splice(s[0], 1)[0]);
+        }
+      } else {
+        for (var i = 0; i > s[2]; i--) {
+          p.pre.insertBefore(rows[s[1]], rows[s[0]]);
+          rows.splice(s[0], 0, rows.splice(s[1], 1)[0]);
+        }
+      }
+    }
+  }
+
+  if (fr.lines) {
+    for (var id in fr.lines) {
+      var p = getPane(id);
+      if (!p) {
+        continue;
+      }
+      if (!p.rows.length) {
+        var html = '';
+        for (var l in fr.lines[id]) {
+          html += fr.lines[id][l];
+        }
+        var nodes = parse(html);
+        p.rows = Array.prototype.slice.call(nodes.children);
+        p.pre.appendChild(nodes);
+      } else {
+        for (var l in fr.lines[id]) {
+          var node = parse(fr.lines[id][l]).firstElementChild;
+          p.pre.replaceChild(node, p.rows[l]);
+          p.rows[l] = node;
+        }
+      }
+    }
+  }
+
+  if (fr.patch) {
+    for (var id in fr.patch) {
+      var p = getPane(id);
+      if (!p) {
+        continue;
+      }
+      for (var l in fr.patch[id]) {
+        // Replace a range of the row's elements: [start, count, html]
+        var pt = fr.patch[id][l];
+        var row = p.rows[l];
+        var ref = row.children[pt[0] + pt[1]] || null;
+        for (var i = 0; i < pt[1]; i++) {
+          row.removeChild(row.children[pt[0]]);
+        }
+        row.insertBefore(parse(pt[2]), ref);
+      }
+    }
   }
-  setTimeout(decompress, 0);
+
+  if (fr.cursor) {
+    for (var id in fr.cursor) {
+      cursors[id] = fr.cursor[id];
+    }
+  }
+}
+
+function flush() {
+  // Applies the queued frames in one pass.  Only the last cursor positions
+  // are applied since measuring them forces a layout.
+  scheduled = false;
+  var queue = pending;
+  pending = [];
+  for (var i = 0; i < queue.length; i++) {
+    applyFrame(queue[i]);
+  }
+  for (var id in cursors) {
+    var p = getPane(id);
+    if (p) {
+      moveCursor(p, cursors[id]);
+    }
+  }
+  cursors = {};
 }
 
 window.tmux = new (function() {
@@ -39,46 +242,64 @@ window.tmux = new (function() {
     return 0;
   }
 
+  function schedule(adj) {
+    // Playback waits for more chunks if there aren't enough frames yet.
+    waiting = frames.length < 3;
+    if (!waiting) {
+      var n = nextDelay() * 1000;
+      if (n) {
+        timerID = setTimeout(nextFrame, (n * speed) - adj);
+      }
+    }
+  }
+
+  function loadedMore() {
+    if (waiting) {
+      schedule(0);
+    }
+  }
+
   function nextFrame(no_advance) {
+    // Frames are queued and applied on the next animation frame.  When not
+    // advancing, the caller flushes.
     var d = new Date();
     clearInterval(timerID);
     var fr = frames[frame % frames.length];
     frame++;
+    pending.push(fr);
     if (fr.reset) {
-      document.querySelector('.$prefix').innerHTML = fr.layout;
       return nextFrame(no_advance);
     }
 
-    if (fr.lines) {
-      for (var id in fr.lines) {
-        var container = document.querySelector('#p' + id + ' > pre');
-        if (!container) {
-          continue;
-        }
-        if (!container.childNodes.length) {
-          var html = '';
-          for (var l in fr.lines[id]) {
-            html += fr.lines[id][l];
-          }
-          container.innerHTML = html;
-        } else {
-          for (var l in fr.lines[id]) {
-            container.childNodes[l].outerHTML = fr.lines[id][l];
-          }
-        }
+    if (!!!no_advance) {
+      if (!scheduled) {
+        scheduled = true;
+        raf(flush);
       }
+      schedule((new Date()) - d);
     }
+  }
 
-    if (!!!no_advance && frames.length > 2) {
-      var n = nextDelay() * 1000;
-      if (n) {
-        var adj = (new Date()) - d;
-        timerID = setTimeout(nextFrame, (n * speed) - adj);
+  function start() {
+    // The first frame is already on the page if it was rendered with it.
+    // Its layout and rows are kept and playback continues after it.
+    if (!document.querySelector('.$prefix').children.length) {
+      nextFrame();
+      return;
+    }
+
+    frame = frames[1] && frames[1].lines ? 2 : 1;
+    for (var i = 0; i < frame; i++) {
+      if (frames[i].cursor) {
+        pending.push({cursor: frames[i].cursor});
       }
     }
+    scheduled = true;
+    raf(flush);
+    schedule(0);
   }
 
-  decompress(nextFrame);
+  decompress(start, loadedMore);
 
   this.setSpeedMultiplier = function(d) {
     // This is a multiplier!
@@ -93,6 +314,7 @@ window.tmux = new (function() {
   };
 
   this.stop = function() {
+    waiting = false;
     clearInterval(timerID);
   };
 
@@ -112,9 +334,70 @@ window.tmux = new (function() {
       nextFrame(true);
       n--;
     }
+    flush();
+  };
+
+  this.search = function(query) {
+    // Finds where all of the query's words appeared together in a row.
+    // Returns a list of {frame, pane, row} sorted by frame.
+    var tokens = (query.toLowerCase().match(/[a-z0-9_]+/g) || [])
+      .filter(function(t) { return t.length > 1; });
+    if (!tokens.length) {
+      return [];
+    }
+
+    var found = postings(tokens[0]);
+    for (var i = 1; i < tokens.length && found.length; i++) {
+      var keys = {};
+      postings(tokens[i]).forEach(function(p) {
+        keys[p.frame + ',' + p.pane + ',' + p.row] = true;
+      });
+      found = found.filter(function(p) {
+        return keys[p.frame + ',' + p.pane + ',' + p.row];
+      });
+    }
+    return found.slice();
+  };
+
+  this.seek = function(n) {
+    // Shows frame n.  Frames are built from the previous frames, so they're
+    // replayed from the last reset before it.
+    this.stop();
+    while (n >= frames.length && loadChunk()) {}
+    if (n < 0 || n >= frames.length) {
+      return;
+    }
+
+    var start = n;
+    while (start > 0 && !frames[start].reset) {
+      start--;
+    }
+    frame = start;
+    pending = [];
+    while (frame <= n) {
+      nextFrame(true);
+    }
+    flush();
+  };
+
+  this.find = function(query) {
+    // Shows the next frame where the query appeared.
+    var found = this.search(query);
+    if (!found.length) {
+      return null;
+    }
+    var current = (frame - 1) % Math.max(frames.length, 1);
+    var match = found[0];
+    for (var i = 0; i < found.length; i++) {
+      if (found[i].frame > current) {
+        match = found[i];
+        break;
+      }
+    }
+    this.seek(match.frame);
+    return match;
   };
 
   // Moving backwards is currently not supported due to how frames are built
-  // from the previous frames.  This would need refactoring to add the ability
-  // to move backwards.
+  // from the previous frames.  Use seek() to jump to an earlier frame.
 })();
@@ -0,0 +1,28 @@
+// Inflates text/tmux-data blocks.  Browsers with a DecompressionStream
+// inflate them off the main thread.  Others fall back to inflating with pako
+// in a later task so the page can render first.
+var loadData = require('./data');
+
+function toBytes(text) {
+  var bin = atob(text.replace(/\s+/g, ''));
+  var bytes = new Uint8Array(bin.length);
+  for (var i = 0; i < bin.length; i++) {
+    bytes[i] = bin.charCodeAt(i);
+  }
+  return bytes;
+}
+
+module.exports = function inflate(text, cb) {
+  if (typeof DecompressionStream === 'undefined') {
+    setTimeout(function() {
+      cb(loadData(text));
+    }, 0);
+    return;
+  }
+
+  var stream = new Blob([toBytes(text)]).stream()
+    .pipeThrough(new DecompressionStream('gzip'));
+  new Response(stream).text().then(cb, function() {
+    cb(loadData(text));
+  });
+};
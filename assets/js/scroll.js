@@ -1,15 +1,30 @@
-var loadData = require('./lib/data');
+var inflate = require('./lib/inflate');
 var raf = require('raf');
 var ease = require('eases/quint-out');
 
 function setupPane(pane) {
+  // The visible lines are already on the page.  Scrolling is set up once the
+  // history is inflated.
   var hunks = pane.querySelectorAll('script[type="text/tmux-data"]');
-  var lines = [];
+  var texts = [];
   for (var i = 0; i < hunks.length; i++) {
-    var data = loadData(hunks[i].textContent || hunks[i].innerText);
-    lines.push.apply(lines, data.split('\n'));
+    texts.push(hunks[i].textContent || hunks[i].innerText);
   }
 
+  var parts = [];
+  var remaining = texts.length;
+  texts.forEach(function(text, i) {
+    inflate(text, function(data) {
+      parts[i] = data.split('\n');
+      remaining--;
+      if (remaining === 0) {
+        setupScroll(pane, [].concat.apply([], parts));
+      }
+    });
+  });
+}
+
+function setupScroll(pane, lines) {
   var height = parseInt(pane.dataset.h, 10);
   var pre = pane.querySelector('pre');
   var top = lines.length - height;
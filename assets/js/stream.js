@@ -12,6 +12,12 @@ function parse(xhr) {
       document.querySelector('style').innerText = m[1];
     }
 
+    // The interval changes when the writer backs off.
+    m = /<script type="text\/tmux-interval">([\d.]+)<\/script>/.exec(this.responseText);
+    if (m) {
+      interval = parseFloat(m[1]);
+    }
+
     setTimeout(reload, interval * 1000);
   }
 }
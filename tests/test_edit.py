@@ -0,0 +1,36 @@
+# coding: utf8
+import unittest
+
+from tmux2html.edit import trim
+
+
+class TrimTest(unittest.TestCase):
+    frames = [
+        {'delay': 0, 'reset': True, 'layout': 'layout'},
+        {'delay': 0, 'lines': {1: {0: 'a', 1: 'b'}}, 'cursor': {1: [0, 0]}},
+        {'delay': 1, 'lines': {1: {0: 'c'}}},
+        # Idle from 1 to 100 seconds.
+        {'delay': 99, 'lines': {1: {1: 'd'}}},
+        {'delay': 1},
+    ]
+
+    def test_idle_gap(self):
+        self.assertEqual(list(trim(self.frames, 10, 20)), [
+            {'delay': 0, 'reset': True, 'layout': 'layout'},
+            {'delay': 0, 'lines': {1: {0: 'c', 1: 'b'}},
+             'cursor': {1: [0, 0]}},
+            {'delay': 10},
+        ])
+
+    def test_frames_in_range(self):
+        self.assertEqual(list(trim(self.frames, 10, 100.5)), [
+            {'delay': 0, 'reset': True, 'layout': 'layout'},
+            {'delay': 0, 'lines': {1: {0: 'c', 1: 'b'}},
+             'cursor': {1: [0, 0]}},
+            {'delay': 90, 'lines': {1: {1: 'd'}}},
+            {'delay': 0.5},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+# coding: utf8
+"""Finding out what makes a recording big.
+
+    python -m tmux2html.analyze recording.html
+
+The recording's frames are read and their bytes are attributed to the parts
+of the page, the panes, the kinds of frames, and the markup of the rows.
+Sizes are raw (the JSON in the frames) and stored (compressed and base64
+encoded, as in the page).  The stored size of a part is for the part
+compressed on its own, so the parts don't add up to the total.
+
+The savings of encoding options are estimated by encoding the frames again
+with them, and compared to the frame data as it's stored in the page.  The
+estimates are on top of the options the recording was made with.  Merging
+frames with `--min-frame-delay` is about what a longer `--interval` would
+have captured.
+"""
+from __future__ import print_function, division
+
+import re
+import sys
+import json
+import zlib
+import argparse
+
+from . import utils
+from .classes import ClassNames, frame_html
+from .color import term_to_rgb
+from .edit import Recording, join
+from .frames import Encoder, chunks, inner
+from .main import classname
+from .search import plain_text
+
+_attr_re = re.compile(r' (class|data-seq)="[^"]*"')
+_tag_re = re.compile(r'<[^>]*>')
+_color_re = re.compile(r'(?:^|;)\s*(?:background-)?color:\s*(#[0-9a-fA-F]{6})')
+
+palette = set('#{:02x}{:02x}{:02x}'.format(*term_to_rgb(n))
+              for n in range(256))
+
+frame_keys = ('layout', 'lines', 'patch', 'scroll', 'cursor', 'delay')
+
+
+class Size(object):
+    """The raw and stored size of text that's compressed as it's added."""
+
+    def __init__(self):
+        self.raw = 0
+        self.compressed = 0
+        self.count = 0
+        self._z = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    def add(self, text):
+        data = text.encode('utf8')
+        self.count += 1
+        self.raw += len(data)
+        self.compressed += len(self._z.compress(data))
+
+    @property
+    def stored(self):
+        if self._z is not None:
+            self.compressed += len(self._z.flush())
+            self._z = None
+        return (self.compressed + 2) // 3 * 4
+
+
+def stored_size(frames):
+    """Get the stored size of frames, chunked like a recording."""
+    return sum(len(''.join(utils.compress_data(x))) for x in chunks(frames))
+
+
+def css_size(rules):
+    """Get the size of style rules as they're written in the page."""
+    return sum(len('div.{} pre span.{} {{{};}}'.format(
+        classname, k, ';'.join(v) if isinstance(v, (tuple, list)) else v))
+        for k, v in rules.items())
+
+
+def colors(rules):
+    """Get the colors set by style rules."""
+    found = set()
+    for style in rules.values():
+        found.update(x.lower() for x in _color_re.findall(style))
+    return found
+
+
+class Analysis(object):
+    """Sizes of the parts of a recording."""
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.frames = 0
+        self.keys = dict((k, Size()) for k in frame_keys)
+        self.panes = {}
+        self.markup = dict((k, Size()) for k in ('text', 'class', 'data-seq',
+                                                 'tags'))
+        self.rows = {}
+
+    def _pane(self, pane):
+        if pane not in self.panes:
+            self.panes[pane] = Size()
+        return self.panes[pane]
+
+    def _markup(self, html):
+        for m in _tag_re.finditer(html):
+            tag = m.group(0)
+            for attr in _attr_re.finditer(tag):
+                self.markup[attr.group(1)].add(attr.group(0))
+            self.markup['tags'].add(_attr_re.sub('', tag))
+        self.markup['text'].add(_tag_re.sub('', html))
+
+    def add(self, frame):
+        """Add an encoded frame."""
+        self.frames += 1
+        for key in frame_keys:
+            if key not in frame:
+                continue
+            self.keys[key].add(json.dumps(frame[key]))
+            if key in ('layout', 'delay'):
+                continue
+            for pane, value in frame[key].items():
+                self._pane(pane).add(json.dumps(value))
+        for html in frame_html([frame]):
+            self._markup(html)
+
+    def add_rows(self, frame):
+        """Count the rows of a decoded frame."""
+        for rows in frame.get('lines', {}).values():
+            for html in rows.values():
+                content = inner(html)
+                entry = self.rows.get(content)
+                if entry is None:
+                    self.rows[content] = 1
+                else:
+                    self.rows[content] = entry + 1
+
+    def run(self):
+        for frame in self.recording.frames():
+            self.add(frame)
+        for frame in join([self.recording]):
+            self.add_rows(frame)
+
+
+def kb(n):
+    return '{:0.1f} KB'.format(n / 1024)
+
+
+def _table(title, rows):
+    print()
+    print(title)
+    for row in rows:
+        print('  {:<28}{:>14}{:>14}'.format(*row))
+
+
+def report(analysis, top=10, estimates=True):
+    recording = analysis.recording
+    total = len(recording.data)
+    data = sum(end - start for start, end in recording.chunks)
+    index = 0
+    if recording.index_span:
+        index = recording.index_span[1] - recording.index_span[0]
+    first = recording.panes_end - recording.panes_start
+    css = sum(len(k) + len(v) for k, v in recording.rules.items())
+    _table('Page ({})'.format(recording.filename), [
+        ('part', 'bytes', 'share'),
+        ('frame data', kb(data), '{:0.1%}'.format(data / total)),
+        ('search index', kb(index), '{:0.1%}'.format(index / total)),
+        ('first frame', kb(first), '{:0.1%}'.format(first / total)),
+        ('css rules', kb(css), '{:0.1%}'.format(css / total)),
+        ('everything else', kb(total - data - index - first - css),
+         '{:0.1%}'.format((total - data - index - first - css) / total)),
+        ('total', kb(total), ''),
+    ])
+
+    _table('Frames ({} frames in {} chunks)'.format(
+        analysis.frames, len(recording.chunks)),
+        [('key (frames)', 'raw', 'stored')] + [
+            ('{} ({})'.format(k, v.count), kb(v.raw), kb(v.stored))
+            for k, v in sorted(analysis.keys.items(),
+                               key=lambda x: -x[1].raw) if v.count])
+
+    _table('Panes (lines, patches, scrolling, cursor)',
+           [('pane (updates)', 'raw', 'stored')] + [
+               ('%{} ({})'.format(k, v.count), kb(v.raw), kb(v.stored))
+               for k, v in sorted(analysis.panes.items(),
+                                  key=lambda x: -x[1].raw)])
+
+    _table('Row markup', [('part', 'raw', 'stored')] + [
+        (k, kb(v.raw), kb(v.stored))
+        for k, v in sorted(analysis.markup.items(), key=lambda x: -x[1].raw)])
+
+    used = colors(recording.rules)
+    print()
+    print('CSS: {} rules, {} colors ({} outside the 256 color palette)'
+          .format(len(recording.rules), len(used), len(used - palette)))
+
+    repeated = sorted(((n, len(k), k) for k, n in analysis.rows.items()
+                       if n > 1), reverse=True,
+                      key=lambda x: (x[0] * x[1], x[0]))[:top]
+    if repeated:
+        print()
+        print('Most repeated rows')
+        print('  {:>7}{:>12}  {}'.format('times', 'raw', 'text'))
+        for n, size, content in repeated:
+            text = plain_text(content).strip() or '(blank)'
+            print('  {:>7}{:>12}  {}'.format(n, kb(n * size), text[:48]))
+
+    if not estimates:
+        return
+
+    def frames():
+        return join([recording])
+
+    results = [('as recorded', data)]
+
+    # The stylesheet changes with the class names, so it's counted too.
+    rules = dict((k, v.rstrip(';')) for k, v in recording.rules.items())
+    names = ClassNames(rules)
+    for html in frame_html(recording.frames()):
+        names.count(html)
+    short_css = names.assign()
+    results.append(('--short-classes', stored_size(
+        names.rewrite_frames(recording.frames()))
+        + css_size(short_css) - css_size(rules)))
+    for t in (0.5, 1, 2):
+        results.append(('--min-frame-delay {}'.format(t), stored_size(
+            Encoder(min_delay=t).encode(frames()))))
+    for t in (1, 2):
+        results.append(('--coalesce {}'.format(t), stored_size(
+            Encoder(coalesce=t).encode(frames()))))
+    _table('Estimated frame data with options',
+           [('option', 'stored', 'saved')] + [
+               (name, kb(size), '{:0.1%}'.format(1 - size / data))
+               for name, size in results])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Show what the bytes of a recording are spent on')
+    parser.add_argument('recording', help='Recording to analyze')
+    parser.add_argument('--top', default=10, type=int,
+                        help='Number of repeated rows to show')
+    parser.add_argument('--no-estimates', action='store_true',
+                        help='Don\'t estimate the savings of options, which '
+                        'encodes the recording a few times')
+    args = parser.parse_args()
+
+    try:
+        recording = Recording(args.recording)
+    except (IOError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    try:
+        analysis = Analysis(recording)
+        analysis.run()
+        report(analysis, args.top, not args.no_estimates)
+    finally:
+        recording.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# coding: utf8
+"""On-disk cache of rendered panes.
+
+Entries are keyed by a hash of everything that goes into rendering a pane,
+including the source of the renderer itself, so a pane that didn't change
+since the last run isn't rendered again.
+"""
+import os
+import json
+import hashlib
+import tempfile
+
+_basedir = os.path.dirname(__file__)
+_version = []
+
+
+def render_version():
+    """Get a hash of the renderer's source."""
+    if not _version:
+        h = hashlib.sha1()
+        for name in ('main.py', 'color.py', 'utils.py'):
+            with open(os.path.join(_basedir, name), 'rb') as fp:
+                h.update(fp.read())
+        _version.append(h.hexdigest())
+    return _version[0]
+
+
+class RenderCache(object):
+    """A directory of rendered panes and the CSS classes they use.
+
+    The least recently used entries are removed when the cache grows past
+    `max_bytes`.  An entry's modification time is its last use.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, *parts):
+        """Get the key for a render's inputs."""
+        data = json.dumps([render_version()] + list(parts))
+        return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Get the `(html, css)` of an entry, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                entry = json.loads(fp.read().decode('utf8'))
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry['html'], entry['css']
+
+    def put(self, key, html, css):
+        """Store an entry."""
+        data = json.dumps({'html': html, 'css': css}).encode('utf8')
+        tmp = tempfile.NamedTemporaryFile(prefix='tmp2html.',
+                                          dir=self.directory, delete=False)
+        try:
+            tmp.write(data)
+        finally:
+            tmp.close()
+        os.rename(tmp.name, self._path(key))
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
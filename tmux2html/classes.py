@@ -0,0 +1,152 @@
+# coding: utf8
+"""Shorter class names for colors.
+
+Color classes are named after their colors (`f1`, `b-rgb_1_2_3`), and spans
+usually have one for the foreground and one for the background.  Once a
+document's markup is known, the color classes are renamed to short names
+assigned by how often they're used, and foreground and background classes
+that always appear together are merged into one class.
+"""
+import re
+
+from . import utils
+
+
+_class_re = re.compile(r'class="([^"]*)"')
+_color_re = re.compile(r'^[fb](?:\d+|-rgb_[\d_]+)$')
+_data_re = re.compile(r'(<script type="text/tmux-data">)([^<]*)(</script>)')
+
+# First characters that don't start any of the other classes.
+_first = 'adeijkmoqxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_rest = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def short_name(n):
+    """Get the `n`th short class name."""
+    name = _first[n % len(_first)]
+    n //= len(_first)
+    while n:
+        n -= 1
+        name += _rest[n % len(_rest)]
+        n //= len(_rest)
+    return name
+
+
+class ClassNames(object):
+    """Renames the color classes in a document.
+
+    All of the document's markup is passed to `count()` before any of it is
+    passed to `rewrite()`.  Compressed pane history is included.
+    """
+
+    def __init__(self, css):
+        self.css = css
+        self.counts = {}
+        self.pairs = {}
+        self.names = None
+
+    def _split(self, classes):
+        fg = bg = None
+        for c in classes:
+            if c in self.css and _color_re.match(c):
+                if c[0] == 'f':
+                    fg = c
+                else:
+                    bg = c
+        return fg, bg
+
+    def count(self, html):
+        """Count the classes used in markup."""
+        for m in _data_re.finditer(html):
+            self.count(utils.decompress_data(m.group(2)))
+        for m in _class_re.finditer(html):
+            fg, bg = self._split(m.group(1).split())
+            for c in (fg, bg):
+                if c:
+                    self.counts[c] = self.counts.get(c, 0) + 1
+            if fg and bg:
+                self.pairs[(fg, bg)] = self.pairs.get((fg, bg), 0) + 1
+
+    def assign(self):
+        """Assign the short names and return the stylesheet that uses them."""
+        units = {}
+        merged = {}
+        for (fg, bg), n in self.pairs.items():
+            if self.counts[fg] == n and self.counts[bg] == n:
+                units[(fg, bg)] = n
+                merged[fg] = merged[bg] = (fg, bg)
+        for c, n in self.counts.items():
+            if c not in merged:
+                units[(c,)] = n
+
+        self.names = {}
+        css = dict((k, v) for k, v in self.css.items()
+                   if not _color_re.match(k))
+        ordered = sorted(units, key=lambda x: (-units[x], x))
+        for i, unit in enumerate(ordered):
+            name = short_name(i)
+            styles = []
+            for c in unit:
+                self.names[c] = name
+                v = self.css[c]
+                styles.extend(v if isinstance(v, (tuple, list)) else [v])
+            css[name] = styles
+        return css
+
+    def _rewrite_classes(self, m):
+        out = []
+        for c in m.group(1).split():
+            c = self.names.get(c, c)
+            if c not in out:
+                out.append(c)
+        return 'class="{}"'.format(' '.join(out))
+
+    def _rewrite_data(self, m):
+        return m.group(1) + ''.join(utils.compress_data(
+            self.rewrite(utils.decompress_data(m.group(2))))) + m.group(3)
+
+    def rewrite(self, html):
+        """Rename the classes in markup."""
+        html = _data_re.sub(self._rewrite_data, html)
+        return _class_re.sub(self._rewrite_classes, html)
+
+    def frames(self, frames):
+        """Rename the classes in encoded frames.
+
+        Returns the stylesheet and new frames.
+        """
+        for html in frame_html(frames):
+            self.count(html)
+        css = self.assign()
+        return css, list(self.rewrite_frames(frames))
+
+    def rewrite_frames(self, frames):
+        """Rename the classes in encoded frames once they're assigned."""
+        for frame in frames:
+            frame = dict(frame)
+            if 'layout' in frame:
+                frame['layout'] = self.rewrite(frame['layout'])
+            if 'lines' in frame:
+                frame['lines'] = dict(
+                    (pane, dict((row, self.rewrite(html))
+                                for row, html in rows.items()))
+                    for pane, rows in frame['lines'].items())
+            if 'patch' in frame:
+                frame['patch'] = dict(
+                    (pane, dict((row, p[:2] + [self.rewrite(p[2])])
+                                for row, p in rows.items()))
+                    for pane, rows in frame['patch'].items())
+            yield frame
+
+
+def frame_html(frames):
+    """Get the markup in encoded frames."""
+    for frame in frames:
+        if 'layout' in frame:
+            yield frame['layout']
+        for rows in frame.get('lines', {}).values():
+            for html in rows.values():
+                yield html
+        for rows in frame.get('patch', {}).values():
+            for p in rows.values():
+                yield p[2]
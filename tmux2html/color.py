@@ -1,3 +1,5 @@
+from __future__ import division
+
 _colors_8 = [
     (0x00, 0x00, 0x00),
     (0xbb, 0x00, 0x00),
@@ -44,6 +46,20 @@ def term_to_rgb(n, style=None):
     return (c, c, c)
 
 
+def quantize(rgb, colors):
+    '''Snap an R/G/B color to a palette of at most `colors` colors.
+
+    The palette is an even grid in gamma encoded sRGB, whose steps are closer
+    to even in perceived lightness than steps in linear light.  The smallest
+    palette has 8 colors.
+    '''
+    levels = 2
+    while (levels + 1) ** 3 <= colors:
+        levels += 1
+    step = 255 / (levels - 1)
+    return tuple(int(round(round(c / step) * step)) for c in rgb)
+
+
 def _parse_colors(parts):
     type_ = next(parts)
     if type_ == 2:
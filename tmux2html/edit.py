@@ -0,0 +1,319 @@
+# coding: utf8
+"""Editing recorded animations.
+
+Recordings can be trimmed, sped up, stripped of panes, and joined without
+recording them again:
+
+    python -m tmux2html.edit -o short.html --start 60 --end 90 long.html
+
+The frames are read from the recordings one chunk at a time, decoded, edited,
+and encoded again as they pass through, so a long recording is edited in
+about the time it takes to compress it and in bounded memory.  Times are in
+seconds from the start of the joined recordings, before the speed changes.
+
+The first recording's page is kept for everything around the frames, so the
+recordings should be made with the same colors.
+"""
+from __future__ import print_function, division
+
+import re
+import sys
+import json
+import mmap
+import argparse
+import itertools
+
+from . import utils
+from .frames import Encoder, chunks, decode, first_frame, is_update, row_html
+from .main import atomic_output, classname
+from .search import SearchIndex
+
+_script_re = re.compile(
+    br'<script type="text/tmux-(data|index)">([^<]*)</script>')
+_rule_re = re.compile(r'div\.{} pre span\.([\w-]+) \{{([^}}]*)\}}'
+                      .format(re.escape(classname)))
+_pane_re = re.compile(r'(<div id="p(\d+)" class="pane" data-w="(\d+)" '
+                      r'data-h="(\d+)"><pre>)(</pre>)')
+_container = '<div class="{}">'.format(classname).encode('utf8')
+
+
+class Recording(object):
+    """An animation page written by tmux2html.
+
+    The file is memory mapped and only the positions of its frame chunks are
+    kept.  Chunks are inflated when the frames are read.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'rb')
+        try:
+            self.data = mmap.mmap(self.fp.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.fp.close()
+            raise ValueError('{} is not a recording'.format(filename))
+
+        self.chunks = []
+        self.index_span = None
+        start = end = None
+        for m in _script_re.finditer(self.data):
+            if start is None:
+                start = m.start()
+            end = m.end()
+            if m.group(1) == b'data':
+                self.chunks.append(m.span(2))
+            else:
+                self.index_span = m.span(2)
+
+        head = self.data[:start or 0]
+        if not self.chunks or _container not in head:
+            self.close()
+            raise ValueError('{} is not a recording'.format(filename))
+
+        self.frames_span = (start, end)
+        self.panes_start = head.rindex(_container) + len(_container)
+        self.panes_end = head.rindex(b'</div>')
+        self.style_end = head.rindex(b'</style>', 0, self.panes_start)
+        self.rules = dict(_rule_re.findall(
+            head[:self.style_end].decode('utf8')))
+
+    def frames(self):
+        """Get the encoded frames."""
+        for start, end in self.chunks:
+            data = utils.decompress_data(self.data[start:end].decode('utf8'))
+            for frame in json.loads(data):
+                yield frame
+
+    def close(self):
+        self.data.close()
+        self.fp.close()
+
+
+def join(recordings):
+    """Get the decoded frames of the recordings one after the other."""
+    for recording in recordings:
+        for frame in decode(recording.frames()):
+            yield frame
+
+
+def _blank_pane(m):
+    w, h = int(m.group(3)), int(m.group(4))
+    return m.group(1) + ''.join(
+        row_html(row, '<span class="ns">{}</span>'.format(' ' * w))
+        for row in range(h)) + m.group(5)
+
+
+def drop_panes(frames, panes):
+    """Remove the content of panes.  They're left blank in the layout.
+
+    The delay of frames that only updated the dropped panes is added to the
+    next frame.
+    """
+    carry = 0
+    for frame in frames:
+        frame = dict(frame)
+        if frame.get('reset'):
+            frame['layout'] = _pane_re.sub(
+                lambda m: _blank_pane(m) if int(m.group(2)) in panes
+                else m.group(0), frame['layout'])
+        elif is_update(frame):
+            for key in ('lines', 'cursor'):
+                if key not in frame:
+                    continue
+                kept = dict((k, v) for k, v in frame[key].items()
+                            if k not in panes)
+                if kept:
+                    frame[key] = kept
+                else:
+                    del frame[key]
+            if not is_update(frame):
+                carry += frame['delay']
+                continue
+        frame['delay'] += carry
+        carry = 0
+        yield frame
+
+
+def _screen(layout, rows, cursors):
+    """Get frames that reset to a layout and show rows and cursors."""
+    yield {'delay': 0, 'reset': True, 'layout': layout}
+    screen = {'delay': 0}
+    if rows:
+        screen['lines'] = rows
+    if cursors:
+        screen['cursor'] = cursors
+    if is_update(screen):
+        yield screen
+
+
+def trim(frames, start=0, end=None):
+    """Keep the frames from `start` to `end` seconds.
+
+    The frames before `start` are replayed, and the result starts with a
+    reset to their layout and a frame with the rows and cursors that were
+    on the screen at `start`, so it plays on its own.  If nothing changed
+    between `start` and `end`, that screen is shown for the whole time.
+    Frames after `end` aren't read.
+    """
+    t = 0
+    last = 0
+    started = False
+    layout = None
+    rows = {}
+    cursors = {}
+    for frame in frames:
+        t += frame['delay']
+        if end is not None and t > end:
+            if started:
+                yield {'delay': end - last}
+            elif layout is not None:
+                for out in _screen(layout, rows, cursors):
+                    yield out
+                yield {'delay': end - start}
+            return
+
+        if not started:
+            if t < start:
+                if frame.get('reset'):
+                    layout = frame['layout']
+                    rows = {}
+                    cursors = {}
+                for pane, lines in frame.get('lines', {}).items():
+                    rows.setdefault(pane, {}).update(lines)
+                cursors.update(frame.get('cursor', {}))
+                continue
+
+            started = True
+            if layout is not None and not frame.get('reset'):
+                for out in _screen(layout, rows, cursors):
+                    yield out
+            frame = dict(frame, delay=t - start)
+
+        yield frame
+        last = t
+
+
+def retime(frames, speed):
+    """Divide the delays by `speed`."""
+    for frame in frames:
+        yield dict(frame, delay=frame['delay'] / speed)
+
+
+def merge_styles(recordings):
+    """Get the style rules the other recordings add to the first one's.
+
+    Raises ValueError if recordings use a class name for different styles,
+    which happens with short class names.
+    """
+    rules = dict(recordings[0].rules)
+    extra = []
+    for recording in recordings[1:]:
+        for name, style in sorted(recording.rules.items()):
+            if name not in rules:
+                rules[name] = style
+                extra.append('div.{} pre span.{} {{{}}}'.format(
+                    classname, name, style))
+            elif rules[name] != style:
+                raise ValueError('{} uses the class {} for a different '
+                                 'style'.format(recording.filename, name))
+    return ''.join(extra)
+
+
+def page(recordings, frames, encoder):
+    """Get the pieces of the edited page."""
+    first = recordings[0]
+    data = first.data
+    extra_css = merge_styles(recordings)
+
+    encoded = encoder.encode(frames)
+    head = list(itertools.islice(encoded, 2))
+    if not head:
+        raise ValueError('No frames are left')
+    encoded = itertools.chain(head, encoded)
+
+    yield data[:first.style_end].decode('utf8')
+    yield extra_css
+    yield data[first.style_end:first.panes_start].decode('utf8')
+    yield first_frame(head)
+    yield data[first.panes_end:first.frames_span[0]].decode('utf8')
+    sep = ''
+    for chunk in chunks(encoded):
+        yield '{}<script type="text/tmux-data">{}</script>'.format(
+            sep, ''.join(utils.compress_data(chunk)))
+        sep = '\n'
+    if encoder.index is not None:
+        yield '\n<script type="text/tmux-index">{}</script>'.format(
+            ''.join(utils.compress_data(json.dumps(encoder.index.dump()))))
+    yield data[first.frames_span[1]:].decode('utf8')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Edit recordings made by tmux2html.  Multiple '
+        'recordings are joined.')
+    parser.add_argument('recordings', nargs='+', help='Recordings to edit')
+    parser.add_argument('-o', '--output', default='',
+                        help='Output file.  Prints to stdout if omitted')
+    parser.add_argument('-m', '--mode', default='644',
+                        type=lambda x: int(x, 8), help='Output file permissions')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Also write a gzip compressed copy of the output')
+    parser.add_argument('--start', default=0, type=float,
+                        help='Seconds to start from')
+    parser.add_argument('--end', default=None, type=float,
+                        help='Seconds to end at')
+    parser.add_argument('--speed', default=1, type=float,
+                        help='Playback speed multiplier')
+    parser.add_argument('--drop-pane', default=[], action='append',
+                        type=lambda x: int(x.lstrip('%')),
+                        help='Pane to blank out (e.g. %%1).  Can be used '
+                        'more than once')
+    parser.add_argument('--max-idle', default=0, type=float,
+                        help='Maximum seconds between frames')
+    parser.add_argument('--min-frame-delay', default=0, type=float,
+                        help='Merge frames that are closer together than '
+                        'this many seconds')
+    parser.add_argument('--coalesce', default=0, type=float,
+                        help='Merge frames that only change the same rows '
+                        'within this many seconds')
+    args = parser.parse_args()
+
+    if args.speed <= 0 or args.start < 0 \
+            or (args.end is not None and args.end <= args.start):
+        print('--speed must be positive and --end must be after --start')
+        sys.exit(1)
+
+    recordings = []
+    try:
+        for filename in args.recordings:
+            recordings.append(Recording(filename))
+
+        frames = join(recordings)
+        if args.drop_pane:
+            frames = drop_panes(frames, set(args.drop_pane))
+        if args.start or args.end is not None:
+            frames = trim(frames, args.start, args.end)
+        if args.speed != 1:
+            frames = retime(frames, args.speed)
+
+        index = None
+        if any(x.index_span for x in recordings):
+            index = SearchIndex()
+        encoder = Encoder(args.max_idle, args.min_frame_delay, args.coalesce,
+                          index)
+        output = page(recordings, frames, encoder)
+        # Check the recordings before anything is written.
+        pieces = [next(output)]
+        atomic_output(itertools.chain(pieces, output), args.output,
+                      mode=args.mode, gz=args.gzip)
+    except (IOError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        for recording in recordings:
+            recording.close()
+
+
+if __name__ == '__main__':
+    main()
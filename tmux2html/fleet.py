@@ -0,0 +1,252 @@
+# coding: utf8
+"""Recording every window on a tmux server.
+
+All windows are captured from one asyncio event loop with a limited number
+of tmux commands running at once.  Each window gets its own recording, which
+is written when the window is closed, when it has been recording for the
+rotation period, or when the recorder stops.
+
+This module requires Python 3.5 or newer.
+"""
+import time
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tmux_layout, utils
+from .schedule import monotonic
+
+# Recordings are kept in memory until they're written, so they're rotated
+# even if a rotation period isn't given.
+default_rotate = 3600
+
+windows_format = '\t'.join(('#{window_id}', '#{session_name}',
+                            '#{window_index}', '#{window_layout}'))
+panes_format = '\t'.join(('#{pane_id}', '#{pane_active}', '#{cursor_x}',
+                          '#{cursor_y}', '#{cursor_flag}',
+                          '#{scroll_position}', '#{scroll_region_lower}'))
+
+
+class WindowRecording(object):
+    """The frames recorded for a window."""
+
+    def __init__(self, renderer, window_id, session, index):
+        self.renderer = renderer
+        self.window_id = window_id
+        self.session = session
+        self.index = index
+        self.css = renderer.base_css()
+        self.frames = []
+        self.layout = None
+        self.panes = []
+        self.changes = {}
+        self.cursors = {}
+        self.started = time.time()
+        self.start = self.last_frame = monotonic()
+
+    def set_layout(self, layout):
+        """Update the window's layout and add a reset frame if it changed."""
+        if layout == self.layout:
+            return
+        self.layout = layout
+        root = tmux_layout.parse_layout(layout)
+        self.panes = utils.pane_list(root)
+        self.changes = {}
+        self.cursors = {}
+        lines = []
+        self.renderer._render_pane(root, lines, self.css, empty=True)
+        self.frames.append({
+            'delay': 0,
+            'reset': True,
+            'layout': ''.join(str(x) for x in lines),
+        })
+
+    def update(self, now, captures):
+        """Add a frame from the panes' `(content, cursor)` captures."""
+        frame = {}
+        cursor = {}
+        for p in self.panes:
+            if p.identifier not in captures:
+                continue
+            content, pos = captures[p.identifier]
+            if not content:
+                continue
+            if self.cursors.get(p.identifier) != pos:
+                self.cursors[p.identifier] = pos
+                cursor[p.identifier] = pos
+
+            rows = self.changes.setdefault(p.identifier, {})
+            rendered = self.renderer._render(content, p.size, css=self.css)
+            for lc in rendered.lines:
+                line_str = str(lc)
+                if rows.get(lc.line) != line_str:
+                    rows[lc.line] = line_str
+                    frame.setdefault(p.identifier, {})[lc.line] = line_str
+
+        if frame or cursor:
+            out = {'delay': max(0, now - self.last_frame)}
+            if frame:
+                out['lines'] = frame
+            if cursor:
+                out['cursor'] = cursor
+            self.frames.append(out)
+            self.last_frame = now
+
+    def finish(self, now):
+        """Get the frames, closed with a frame spanning the idle time."""
+        frames = self.frames
+        if len(frames) > 2:
+            frames.append({'delay': now - self.last_frame})
+        return frames
+
+    def filename(self, output):
+        name = output.format(session=self.session, window=self.index,
+                             id=self.window_id.lstrip('@'))
+        return time.strftime(name, time.localtime(self.started))
+
+
+class Fleet(object):
+    """Records all windows on the tmux server.
+
+    `write` is called with the HTML and file name of each finished
+    recording.  `new_encoder` makes an `Encoder` for each recording.
+    Recordings are rotated every `rotate` seconds.  Recordings that fail to
+    be written are reported and the others are still written.
+    """
+
+    def __init__(self, renderer, output, write, new_encoder, interval=0.5,
+                 rotate=default_rotate, jobs=8):
+        self.renderer = renderer
+        self.output = output
+        self.write = write
+        self.new_encoder = new_encoder
+        self.interval = interval
+        self.rotate = rotate
+        self.jobs = jobs
+        self.recordings = {}
+        self.executor = ThreadPoolExecutor(1)
+        self.writes = []
+        self.failed = 0
+        self.semaphore = None
+
+    async def tmux(self, *args):
+        """Run a tmux command.  Returns None if it fails."""
+        async with self.semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                'tmux', *args, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL)
+            out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            return None
+        return out.decode('utf8')
+
+    async def capture(self, info):
+        """Capture a pane's content and cursor from its `list-panes` info."""
+        identifier, active, x, y, flag, pos, height = info
+        args = ['-S', '-0']
+        if pos:
+            pos = -int(pos)
+            args = ['-S', str(pos), '-E', str(pos + int(height))]
+        content = await self.tmux('capture-pane', '-epJ', '-t', identifier,
+                                  *args)
+        cursor = [-1, -1]
+        if active == '1' and flag != '0':
+            cursor = [int(x), int(y)]
+        return content, cursor
+
+    def finish(self, recording, now):
+        frames = recording.finish(now)
+        if len(frames) < 2:
+            return
+        filename = recording.filename(self.output)
+
+        def encode():
+            self.write(self.renderer.encode(frames, self.new_encoder(),
+                                            recording.css), filename)
+        self.check_writes()
+        future = self.executor.submit(encode)
+        future.filename = filename
+        self.writes.append(future)
+
+    def check_writes(self):
+        """Report the errors of finished writes."""
+        pending = []
+        for future in self.writes:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is not None:
+                self.failed += 1
+                print('Couldn\'t write {}: {}'.format(future.filename,
+                                                      future.exception()))
+        self.writes = pending
+
+    async def tick(self):
+        windows, panes = await asyncio.gather(
+            self.tmux('list-windows', '-a', '-F', windows_format),
+            self.tmux('list-panes', '-a', '-F', panes_format))
+        if windows is None or panes is None:
+            return
+        now = monotonic()
+
+        current = {}
+        for line in windows.splitlines():
+            window_id, session, index, layout = line.split('\t', 3)
+            current[window_id] = (session, index, layout)
+
+        for window_id in list(self.recordings):
+            if window_id not in current:
+                self.finish(self.recordings.pop(window_id), now)
+
+        for window_id, (session, index, layout) in current.items():
+            recording = self.recordings.get(window_id)
+            if recording and self.rotate \
+                    and now - recording.start >= self.rotate:
+                self.finish(recording, now)
+                recording = None
+            if recording is None:
+                recording = WindowRecording(self.renderer, window_id,
+                                            session, index)
+                self.recordings[window_id] = recording
+            recording.set_layout(layout)
+
+        infos = [line.split('\t') for line in panes.splitlines()]
+        results = await asyncio.gather(*[self.capture(x) for x in infos])
+        captures = {}
+        for info, result in zip(infos, results):
+            captures[int(info[0].lstrip('%'))] = result
+
+        for recording in self.recordings.values():
+            recording.update(now, captures)
+
+    async def run(self):
+        self.semaphore = asyncio.Semaphore(self.jobs)
+        start = monotonic()
+        ticks = 0
+        while True:
+            await self.tick()
+            # Missed ticks are skipped instead of run back to back.
+            ticks = max(ticks + 1, int((monotonic() - start) / self.interval))
+            await asyncio.sleep(max(0, start + ticks * self.interval
+                                    - monotonic()))
+
+    def close(self):
+        """Write the remaining recordings."""
+        now = monotonic()
+        for recording in self.recordings.values():
+            self.finish(recording, now)
+        self.recordings = {}
+        self.executor.shutdown(wait=True)
+        self.check_writes()
+
+
+def record(fleet):
+    """Record until interrupted.  Returns the number of failed writes."""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fleet.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+        fleet.close()
+    return fleet.failed
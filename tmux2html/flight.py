@@ -0,0 +1,132 @@
+# coding: utf8
+"""Flight recorder.
+
+Records continuously, keeping only the most recent frames, and writes them
+out when asked to.
+"""
+from __future__ import print_function
+
+import os
+import signal
+from collections import deque
+
+from . import utils
+from .schedule import monotonic
+
+
+def frame_size(frame):
+    """Approximate the memory used by a frame's markup."""
+    size = len(frame.get('layout', ''))
+    for rows in frame.get('lines', {}).values():
+        size += sum(len(x) for x in rows.values())
+    return size
+
+
+class FrameBuffer(object):
+    """A bounded buffer of recorded frames.
+
+    Only the frames from the last `window` seconds are kept, limited to
+    `max_frames` frames and `max_bytes` of markup.  Frames that fall off the
+    front of the buffer are folded into a keyframe so the buffered frames can
+    always be played back on their own.
+    """
+
+    def __init__(self, window, max_frames=0, max_bytes=0):
+        self.window = window
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.layout = ''
+        self.lines = {}
+        self.cursor = {}
+        self.buffer = deque()
+        self.size = 0
+        self.time = 0
+        self.updated = monotonic()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def _fold(self, frame):
+        """Apply a frame to the keyframe."""
+        if frame.get('reset'):
+            self.layout = frame['layout']
+            self.lines = {}
+            self.cursor = {}
+        for pane, rows in frame.get('lines', {}).items():
+            self.lines.setdefault(pane, {}).update(rows)
+        self.cursor.update(frame.get('cursor', {}))
+
+    def _full(self):
+        oldest = self.buffer[0][0]
+        return self.time - oldest > self.window \
+            or (self.max_frames and len(self.buffer) > self.max_frames) \
+            or (self.max_bytes and self.size > self.max_bytes)
+
+    def append(self, frame):
+        self.time += frame['delay']
+        size = frame_size(frame)
+        self.buffer.append((self.time, size, frame))
+        self.size += size
+        self.updated = monotonic()
+
+        while len(self.buffer) > 1 and self._full():
+            _, size, oldest = self.buffer.popleft()
+            self.size -= size
+            self._fold(oldest)
+
+    def frames(self):
+        """Get the buffered frames, starting with the keyframe."""
+        frames = []
+        if self.layout:
+            frames.append({
+                'delay': 0,
+                'reset': True,
+                'layout': self.layout,
+            })
+            if self.lines:
+                frames.append({
+                    'delay': 0,
+                    'lines': dict((k, dict(v)) for k, v in self.lines.items()),
+                    'cursor': dict(self.cursor),
+                })
+        frames.extend(x[2] for x in self.buffer)
+
+        if len(frames) > 2:
+            frames.append({
+                'delay': monotonic() - self.updated,
+            })
+        return frames
+
+
+def bind_key(key):
+    """Bind a tmux key that signals this process to dump its frames."""
+    utils.shell_cmd(['tmux', 'bind-key', key, 'run-shell',
+                     'kill -USR1 {:d}'.format(os.getpid())])
+
+
+def unbind_key(key):
+    utils.shell_cmd(['tmux', 'unbind-key', key], ignore_error=True)
+
+
+def record(frames, buffer, dump):
+    """Buffer frames from a capture generator until it stops.
+
+    `dump` is called with the buffered frames when SIGUSR1 is received.
+    """
+    requested = []
+
+    def request_dump(signum, stack):
+        requested.append(signum)
+
+    prev_handler = signal.signal(signal.SIGUSR1, request_dump)
+    try:
+        for frame in frames:
+            if frame and list(frame) != ['delay']:
+                buffer.append(frame)
+            if requested:
+                del requested[:]
+                dump(buffer.frames())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGUSR1, prev_handler)
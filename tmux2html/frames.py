@@ -0,0 +1,455 @@
+# coding: utf8
+"""Recorded frame encoding.
+
+Frames are dicts with a `delay` in seconds since the previous frame and
+either a `reset` with a new `layout`, or `lines` mapping pane identifiers to
+the rows that changed: `{pane: {row: html}}`.
+
+Encoded frames may also have `scroll`, which moves a range of rows up (or
+down) in the player: `{pane: [top, bottom, rows]}`, and `patch`, which
+replaces a range of a row's top level elements:
+`{pane: {row: [start, count, html]}}`.
+
+The cursor isn't part of the rows.  Frames have a `cursor` with the new
+`[x, y]` position of the panes' cursors, which is `[-1, -1]` when it's
+hidden.
+"""
+from __future__ import division
+
+import re
+import json
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import utils
+
+
+def is_update(frame):
+    """Check if a frame updates the content of panes."""
+    return 'lines' in frame or 'cursor' in frame
+
+
+def touched(frame):
+    """Get the set of (pane, row) pairs a frame changes."""
+    out = set()
+    for pane, rows in frame.get('lines', {}).items():
+        out.update((pane, row) for row in rows)
+    return out
+
+
+def merge(frame, other):
+    """Merge the updates of `other` into `frame`.  `other`'s updates win."""
+    if 'lines' in other:
+        lines = frame.setdefault('lines', {})
+        for pane, rows in other['lines'].items():
+            merged = dict(lines.get(pane, {}))
+            merged.update(rows)
+            lines[pane] = merged
+    if 'cursor' in other:
+        frame.setdefault('cursor', {}).update(other['cursor'])
+    return frame
+
+
+_tag_re = re.compile(r'<(/?)span\b[^>]*>')
+
+
+def inner(html):
+    """Get the content of a row's HTML."""
+    return html[html.index('>') + 1:-len('</div>')]
+
+
+def row_html(row, content):
+    return '<div class="l{0}">{1}</div>'.format(row, content)
+
+
+def runs(content):
+    """Split a row's content into its top level elements.
+
+    Returns None if the row has text outside of an element, since adjacent
+    text nodes can't be told apart once they're in the DOM.
+    """
+    out = []
+    depth = 0
+    start = 0
+    for m in _tag_re.finditer(content):
+        if depth == 0 and m.start() != start:
+            return None
+        if m.group(1):
+            depth -= 1
+            if depth == 0:
+                out.append(content[start:m.end()])
+                start = m.end()
+        else:
+            depth += 1
+    if start != len(content):
+        return None
+    return out
+
+
+def find_scroll(old, new):
+    """Find rows that moved vertically between two lists of rows.
+
+    Returns `(top, bottom, n)`: the rows from `top` to `bottom` (inclusive)
+    moved up by `n` rows, or down if `n` is negative.  Returns None if no
+    more than one row moved.  The region only has rows that are in `old`,
+    since those are the rows the player has.
+    """
+    positions = {}
+    for j, row in enumerate(old):
+        positions.setdefault(row, []).append(j)
+
+    votes = {}
+    for i, row in enumerate(new):
+        if i < len(old) and old[i] == row:
+            continue
+        for j in positions.get(row, ()):
+            if j != i:
+                votes[j - i] = votes.get(j - i, 0) + 1
+    if not votes:
+        return None
+
+    n = max(votes, key=lambda x: (votes[x], -abs(x)))
+    best = (0, 0)
+    start = None
+    for i in range(len(new) + 1):
+        moved = i < min(len(new), len(old)) and 0 <= i + n < len(old) \
+            and new[i] == old[i + n]
+        if moved and start is None:
+            start = i
+        elif not moved and start is not None:
+            if i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+
+    if best[1] - best[0] < 2:
+        return None
+    if n > 0:
+        return (best[0], best[1] - 1 + n, n)
+    return (best[0] + n, best[1] - 1, n)
+
+
+def shift(rows, top, bottom, n):
+    """Move rows like the player does.
+
+    Rows that scroll out of the region are reused for the rows that are
+    scrolled into it.
+    """
+    region = rows[top:bottom + 1]
+    rows[top:bottom + 1] = region[n:] + region[:n]
+
+
+def patch(old, new):
+    """Get a patch that turns the `old` runs into the `new` runs.
+
+    Returns `[start, count, html]`, replacing `count` runs at `start` with
+    `html`.
+    """
+    n = min(len(old), len(new))
+    start = 0
+    while start < n and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < n - start and old[-end - 1] == new[-end - 1]:
+        end += 1
+    return [start, len(old) - start - end,
+            ''.join(new[start:len(new) - end])]
+
+
+def decode(frames):
+    """Turn encoded frames back into captured frames.
+
+    This undoes `Encoder.diff()`: scrolls and patches are applied to the
+    rows like the player does, and the rows they changed are sent in full.
+    Pane identifiers and rows loaded from JSON are turned back into numbers.
+    """
+    state = {}
+    for frame in frames:
+        if frame.get('reset'):
+            state = {}
+        if not is_update(frame) and 'scroll' not in frame \
+                and 'patch' not in frame:
+            yield frame
+            continue
+
+        changed = {}
+        for pane, scroll in frame.get('scroll', {}).items():
+            pane = int(pane)
+            rows = state[pane]
+            before = list(rows)
+            shift(rows, *scroll)
+            changed[pane] = set(
+                i for i, (a, b) in enumerate(zip(before, rows)) if a != b)
+        for pane, rows in frame.get('lines', {}).items():
+            pane = int(pane)
+            current = state.setdefault(pane, [])
+            for row, html in rows.items():
+                row = int(row)
+                current.extend([None] * (row + 1 - len(current)))
+                current[row] = inner(html)
+                changed.setdefault(pane, set()).add(row)
+        for pane, rows in frame.get('patch', {}).items():
+            pane = int(pane)
+            current = state[pane]
+            for row, (start, count, html) in rows.items():
+                row = int(row)
+                old = runs(current[row])
+                current[row] = ''.join(old[:start]) + html \
+                    + ''.join(old[start + count:])
+                changed.setdefault(pane, set()).add(row)
+
+        out = {'delay': frame['delay']}
+        if 'cursor' in frame:
+            out['cursor'] = dict((int(k), v)
+                                 for k, v in frame['cursor'].items())
+        lines = dict((pane, dict((row, row_html(row, state[pane][row]))
+                                 for row in sorted(changed[pane])))
+                     for pane in sorted(changed) if changed[pane])
+        if lines:
+            out['lines'] = lines
+        yield out
+
+
+_empty_pane_re = re.compile(r'(<div id="p(\d+)"[^>]*><pre>)(</pre>)')
+
+
+def first_frame(frames):
+    """Get the markup of the first frame for the page.
+
+    It's the layout of the first frame, which must be a reset, with the rows
+    of the frame after it if it updates them.  The player starts after those
+    frames when the page already has content.  Returns an empty string if
+    the frames don't start with a reset.
+    """
+    if not frames or not frames[0].get('reset'):
+        return ''
+    lines = {}
+    if len(frames) > 1 and 'lines' in frames[1]:
+        lines = frames[1]['lines']
+
+    def fill(m):
+        rows = lines.get(int(m.group(2)), {})
+        return m.group(1) + ''.join(rows[r] for r in sorted(rows)) \
+            + m.group(3)
+    return _empty_pane_re.sub(fill, frames[0]['layout'])
+
+
+def chunks(frames, first_size=32 * 1024, size=256 * 1024):
+    """Group frames into JSON arrays of about `size` characters.
+
+    The first chunk is smaller so the player can start before the rest are
+    inflated.  It has at least the first three frames (a reset, the first
+    screen, and a frame to play after it), which the player needs to start
+    playing.  Each chunk is inflated separately, so they're big enough to
+    keep the number of chunks down, but small enough to be inflated in
+    parallel.
+    """
+    out = []
+    length = 0
+    limit = first_size
+    for frame in frames:
+        data = json.dumps(frame)
+        out.append(data)
+        length += len(data)
+        if length >= limit and (limit == size or len(out) >= 3):
+            yield '[{}]'.format(','.join(out))
+            out = []
+            length = 0
+            limit = size
+    if out:
+        yield '[{}]'.format(','.join(out))
+
+
+class Encoder(object):
+    """Encodes captured frames for playback.
+
+    `max_idle` caps the delay of a frame so long periods without changes
+    don't play back in real time.
+
+    Frames arriving less than `min_delay` seconds after a pending frame are
+    merged into it.  Frames that only change rows the pending frame already
+    changes (e.g. a progress bar) are merged as long as they arrive within
+    `coalesce` seconds.  A merged frame shows the final state of its rows at
+    the time of its first frame, so the frames that are played back are at
+    least that far apart.
+
+    If `index` is a `SearchIndex`, the frames are added to it.
+    """
+
+    def __init__(self, max_idle=0, min_delay=0, coalesce=0, index=None):
+        self.max_idle = max_idle
+        self.min_delay = min_delay
+        self.coalesce = max(coalesce, min_delay)
+        self.index = index
+        self.rows = {}
+
+    def _cap(self, frame):
+        if self.max_idle and frame['delay'] > self.max_idle:
+            frame = dict(frame, delay=self.max_idle)
+        return frame
+
+    def compact(self, frames):
+        """Cap idle time and merge frames that are close together."""
+        pending = None
+        span = 0
+        carry = 0
+        for frame in frames:
+            frame = self._cap(frame)
+            if pending is not None and is_update(frame):
+                t = span + frame['delay']
+                if t < self.min_delay or (
+                        t < self.coalesce
+                        and touched(frame) <= touched(pending)):
+                    merge(pending, frame)
+                    span = t
+                    continue
+
+            if pending is not None:
+                yield pending
+                carry = span
+
+            if is_update(frame):
+                pending = merge({'delay': frame['delay'] + carry}, frame)
+                span = 0
+            else:
+                pending = None
+                yield dict(frame, delay=frame['delay'] + carry)
+            carry = 0
+
+        if pending is not None:
+            yield pending
+
+    def diff(self, frames):
+        """Only send the parts of rows that changed.
+
+        The rows the player has are tracked.  If rows moved vertically, the
+        frame gets a `scroll` that moves them in the player.  Changed rows
+        are then sent as a `patch` if it's smaller than the full row.
+        """
+        for frame in frames:
+            if frame.get('reset'):
+                self.rows = {}
+            if 'lines' not in frame:
+                yield frame
+                continue
+
+            out = {'delay': frame['delay']}
+            if 'cursor' in frame:
+                out['cursor'] = frame['cursor']
+            for pane, rows in frame['lines'].items():
+                state = self.rows.setdefault(pane, [])
+                have = len(state)
+                height = max(len(state), max(rows) + 1)
+                state.extend([None] * (height - len(state)))
+                new = list(state)
+                for row, html in rows.items():
+                    new[row] = inner(html)
+
+                scroll = find_scroll(state[:have], new)
+                if scroll:
+                    shifted = list(state)
+                    shift(shifted, *scroll)
+                    before = sum(1 for a, b in zip(state, new) if a != b)
+                    after = sum(1 for a, b in zip(shifted, new) if a != b)
+                    if after < before:
+                        out.setdefault('scroll', {})[pane] = list(scroll)
+                        state = shifted
+
+                for row, content in enumerate(new):
+                    old = state[row]
+                    if old == content:
+                        continue
+                    if old is not None:
+                        a = runs(old)
+                        b = runs(content)
+                        if a is not None and b is not None:
+                            p = patch(a, b)
+                            if len(json.dumps(p)) < len(content):
+                                out.setdefault('patch', {}) \
+                                    .setdefault(pane, {})[row] = p
+                                continue
+                    out.setdefault('lines', {}) \
+                        .setdefault(pane, {})[row] = row_html(row, content)
+                self.rows[pane] = new
+
+            yield out
+
+    def encode(self, frames):
+        """Run all encoding passes over the frames."""
+        frames = self.compact(frames)
+        if self.index is not None:
+            # Index the full rows before they're turned into patches.
+            frames = self.index.scan(frames)
+        for frame in self.diff(frames):
+            yield self._cap(frame)
+
+
+class Pipeline(object):
+    """Encodes frames on a background thread while they're being captured.
+
+    Frames passed to `add()` go through the `encoder` and are grouped into
+    chunks, and each chunk is compressed as soon as it fills.  The first
+    encoded frames are kept in `head`.  `finish()` waits for the last frames
+    and returns the compressed chunks, so there's little left to do when
+    recording stops.
+
+    If `compress` is False, `finish()` returns the encoded frames instead,
+    for passes that need all of them at once.  Only encoding happens in the
+    background then, and the caller compresses the frames at the end.
+
+    If encoding fails, the error is raised by the next `add()` so capturing
+    stops instead of continuing into a pipeline that's no longer running.
+    """
+
+    def __init__(self, encoder, compress=True):
+        self.encoder = encoder
+        self.compress = compress
+        self.results = []
+        self.head = []
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _frames(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            yield frame
+
+    def _tap(self, frames):
+        # Keep the frames needed for the first frame's markup.
+        for frame in frames:
+            if len(self.head) < 2:
+                self.head.append(frame)
+            yield frame
+
+    def _run(self):
+        try:
+            frames = self._tap(self.encoder.encode(self._frames()))
+            if not self.compress:
+                self.results.extend(frames)
+                return
+            for chunk in chunks(frames):
+                self.results.append(''.join(utils.compress_data(chunk)))
+        except Exception as e:
+            self.error = e
+
+    def add(self, frame):
+        """Queue a frame for encoding."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def finish(self):
+        """Wait for the queued frames to be encoded and get the results."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.results
@@ -0,0 +1,219 @@
+# coding: utf8
+"""Incremental export of a pane's history.
+
+Rows don't change once they scroll into a pane's history, so after the first
+export, only the rows added since the last one are captured and rendered.
+They're added to the page as a new compressed block.  A checkpoint is kept
+next to the output with the size of the history, a hash of the last rows
+that were exported up to the last one that isn't blank, and the number of
+blank rows after them, which is how the new rows are found:
+
+- If the history is too short to have been trimmed by `history-limit` and
+  the last rows are where the history size says they should be, the rows
+  after them are new.
+- If they aren't, the history was trimmed by `history-limit` (or grew while
+  it was being captured).  The history is searched for the last rows and the
+  rows after them are new.
+- If the last rows can't be found, or are found more than once, the history
+  was cleared or more rows than `history-limit` were added.  All of the
+  history is new.
+- If the pane's width changed, tmux reflowed the history and everything is
+  exported again.
+
+The screen is exported on every run since it can still change.
+"""
+from __future__ import print_function
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+from . import utils
+
+boundary_rows = 8
+
+_data_re = re.compile(r'<script type="text/tmux-data">([^<]*)</script>')
+_sgr_re = re.compile(r'\x1b\[[0-9;:]*m')
+
+
+def pane_info(target):
+    """Get the history size, history limit, width, and height of a pane."""
+    out = utils.shell_cmd(['tmux', 'display-message', '-p', '-t', target,
+                           '#{history_size},#{history_limit},#{pane_width},'
+                           '#{pane_height}'])
+    return [int(x) for x in out.strip().split(',')]
+
+
+def capture(target, start, end):
+    """Capture rows of a pane.
+
+    Wrapped lines aren't joined, so each line is a row of the pane and line
+    numbers match tmux's.
+    """
+    if end < start:
+        return []
+    out = utils.shell_cmd(['tmux', 'capture-pane', '-ep', '-t', target,
+                           '-S', str(start), '-E', str(end)],
+                          ignore_error=True)
+    rows = out.split('\n')
+    if rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+def rows_hash(rows):
+    return hashlib.sha1('\n'.join(rows).encode('utf8')).hexdigest()
+
+
+def is_blank(row):
+    return not _sgr_re.sub('', row).strip()
+
+
+def find_anchor(rows):
+    """Get the last rows up to the last one that isn't blank.
+
+    Blank rows are too common to tell where the history left off, so the
+    number of blank rows after the anchor is returned with it.
+    """
+    end = len(rows)
+    while end and is_blank(rows[end - 1]):
+        end -= 1
+    return rows[max(0, end - boundary_rows):end], len(rows) - end
+
+
+def _ends_at(rows, i, checkpoint):
+    """Check if the checkpoint's anchor and blank rows start at `i`."""
+    k = checkpoint['boundary']
+    after = checkpoint.get('after', 0)
+    return len(rows) >= i + k + after \
+        and rows_hash(rows[i:i + k]) == checkpoint['hash'] \
+        and all(is_blank(x) for x in rows[i + k:i + k + after])
+
+
+def could_trim(history_size, limit):
+    """Check if tmux could have trimmed the history since it was smaller.
+
+    tmux trims a tenth of the history when it reaches the limit, so a shorter
+    history than what's left after that hasn't been trimmed.
+    """
+    return history_size >= limit - max(1, limit // 10)
+
+
+def find_new(target, history_size, limit, checkpoint):
+    """Get the history rows added since the checkpoint.
+
+    Returns the new rows, the size of the history they were captured from,
+    the anchor of the history and the number of blank rows after it, and
+    whether the checkpoint's rows were found.
+    """
+    tail = checkpoint['boundary'] + checkpoint.get('after', 0)
+    n = history_size - checkpoint['history_size']
+    if n >= 0 and not could_trim(history_size, limit):
+        rows = capture(target, -(n + tail), -1)
+        if len(rows) == n + tail and _ends_at(rows, 0, checkpoint):
+            return (rows[tail:], history_size) + find_anchor(rows) + (True,)
+
+    # The anchor has to be found exactly once.  If it's repeated, guessing
+    # could drop the rows after another copy of it.
+    rows = capture(target, -history_size, -1)
+    found = [i for i in range(len(rows) - tail + 1)
+             if _ends_at(rows, i, checkpoint)]
+    if checkpoint['boundary'] and len(found) == 1:
+        return (rows[found[0] + tail:], len(rows)) + find_anchor(rows) \
+            + (True,)
+    return (rows, len(rows)) + find_anchor(rows) + (False,)
+
+
+def load_checkpoint(filename):
+    try:
+        with open(filename, 'rb') as fp:
+            return json.loads(fp.read().decode('utf8'))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_checkpoint(filename, checkpoint):
+    data = json.dumps(checkpoint).encode('utf8')
+    tmp = tempfile.NamedTemporaryFile(prefix='tmp2html.',
+                                      dir=os.path.dirname(filename) or '.',
+                                      delete=False)
+    try:
+        tmp.write(data)
+    finally:
+        tmp.close()
+    os.rename(tmp.name, filename)
+
+
+def _blocks(output, checkpoint):
+    """Get the history blocks from the last export's page."""
+    try:
+        with open(output, 'rb') as fp:
+            page = fp.read().decode('utf8')
+    except (IOError, OSError):
+        return None
+    blocks = _data_re.findall(page)[:checkpoint['blocks']]
+    if len(blocks) != checkpoint['blocks']:
+        return None
+    return blocks
+
+
+def export(renderer, target, output, write, max_lines=0):
+    """Export a pane's history, only rendering what's new since last time.
+
+    `write` is called with the page.  `max_lines` limits the history of a
+    new export.
+    """
+    filename = output + '.checkpoint'
+    history_size, limit, width, height = pane_info(target)
+    checkpoint = load_checkpoint(filename)
+    blocks = None
+    if checkpoint and checkpoint['target'] == target \
+            and checkpoint['width'] == width:
+        blocks = _blocks(output, checkpoint)
+
+    if blocks is None:
+        checkpoint = {
+            'target': target,
+            'width': width,
+            'rows': 0,
+            'css': renderer.base_css(),
+            'state': None,
+        }
+        blocks = []
+        rows = capture(target, -history_size, -1)
+        anchor, after = find_anchor(rows)
+        history_size = len(rows)
+        if max_lines:
+            rows = rows[-max_lines:]
+    else:
+        rows, history_size, anchor, after, found = find_new(
+            target, history_size, limit, checkpoint)
+        if not found:
+            print('The history was cleared or trimmed past the last export.  '
+                  'Adding all of it.')
+
+    css = checkpoint['css']
+    html, state = renderer.render_rows(rows, width, css, checkpoint['state'],
+                                       checkpoint['rows'])
+    if html:
+        blocks.append(''.join(utils.compress_data('\n'.join(html))))
+    row = checkpoint['rows'] + len(html)
+
+    screen, _ = renderer.render_rows(capture(target, 0, height - 1), width,
+                                     css, state, row,
+                                     utils.get_cursor(target))
+    write(renderer.history_page(blocks, screen, (width, height), css))
+
+    checkpoint.update({
+        'history_size': history_size,
+        'boundary': len(anchor),
+        'hash': rows_hash(anchor),
+        'after': after,
+        'rows': row,
+        'blocks': len(blocks),
+        'state': state,
+    })
+    save_checkpoint(filename, checkpoint)
+    return len(rows)
@@ -0,0 +1,87 @@
+# coding: utf8
+"""Reading saved terminal output.
+
+Logs from `script`, `tmux pipe-pane`, or a program's colored output can be
+much larger than a pane's history.  The file is memory mapped and read a
+line at a time so only the line being rendered is held in memory.  Escape
+sequences other than colors are removed since the log is rendered as plain
+scrollback.
+"""
+import io
+import re
+import sys
+import mmap
+
+_sgr_re = re.compile(r'(\x1b\[[0-9;:]*m)')
+_strip_re = re.compile(
+    r'\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)?'   # OSC (titles, hyperlinks)
+    r'|\x1b[P^_][^\x1b]*(?:\x1b\\)?'        # DCS, PM, APC
+    r'|\x1b\[[0-9;:<=>?]*[ -/]*[@-ln-~]'    # CSI other than colors
+    r'|\x1b\[[<=>?][0-9;:]*m'               # private modes ending in m
+    r'|\x1b[()*+][0-9A-Za-z]'               # character set selection
+    r'|\x1b(?!\[)[ -/]*[0-~]'               # other escapes
+    r'|[\x00-\x08\x0b\x0c\x10-\x1a\x1c-\x1f\x7f]')
+
+
+def _file_lines(fp):
+    try:
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, mmap.error, io.UnsupportedOperation):
+        # Empty files and pipes can't be mapped.
+        for line in iter(fp.readline, b''):
+            yield line
+        return
+
+    try:
+        for line in iter(mm.readline, b''):
+            yield line
+    finally:
+        mm.close()
+
+
+def open_log(filename):
+    """Open a log file for reading.  `-` is stdin."""
+    if filename == '-':
+        return getattr(sys.stdin, 'buffer', sys.stdin)
+    return open(filename, 'rb')
+
+
+def expand_tabs(line, tabsize=8):
+    """Expand tabs without counting the color escapes."""
+    if '\t' not in line:
+        return line
+    out = []
+    col = 0
+    for part in _sgr_re.split(line):
+        if part.startswith('\x1b'):
+            out.append(part)
+            continue
+        for c in part:
+            if c == '\t':
+                n = tabsize - col % tabsize
+                out.append(' ' * n)
+                col += n
+            else:
+                out.append(c)
+                col += 1
+    return ''.join(out)
+
+
+def clean_line(line):
+    """Get the text of a raw log line as it would be left on the screen.
+
+    Carriage returns rewrite the line, so only the text after the last one is
+    kept, along with the colors set before it.  Progress bars and spinners
+    end up as their final state.
+    """
+    line = _strip_re.sub('', line.decode('utf8', 'replace').rstrip('\r\n'))
+    if '\r' in line:
+        i = line.rindex('\r')
+        line = ''.join(_sgr_re.findall(line[:i])) + line[i + 1:]
+    return expand_tabs(line)
+
+
+def log_lines(fp):
+    """Get the cleaned lines of an open log file."""
+    for line in _file_lines(fp):
+        yield clean_line(line)
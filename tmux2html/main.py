@@ -4,14 +4,25 @@ from __future__ import print_function, unicode_literals, division
 import os
 import re
 import sys
+import gzip
 import json
+import stat
 import time
+import zlib
+import struct
 import argparse
 import tempfile
 import unicodedata
-from collections import defaultdict
+import multiprocessing
+from collections import defaultdict, deque
 
-from . import color, utils, tpl
+from . import color, utils, tpl, flight, history, logfile
+from .cache import RenderCache
+from .classes import ClassNames
+from .frames import Encoder, Pipeline, chunks, first_frame
+from .schedule import Scheduler, monotonic
+from .search import SearchIndex
+from .watch import PaneWatcher
 
 try:
     from html import escape
@@ -98,7 +109,6 @@ font_stack = (
 # The following table is referenced from:
 # https://en.wikipedia.org/wiki/Talk%3AVT100#Alternate_character_set
 vt100_alt_charset = {
-    'enabled': False,
     'table': [
         #    0       1       2       3       4       5       6       7
         0x25c6, 0x2592, 0x2409, 0x240c, 0x240d, 0x240a, 0x00b0, 0x00b1,
@@ -140,11 +150,85 @@ class Pane(object):
         return out
 
 
+class RenderState(object):
+    """The state of a single pane's render.
+
+    `css` is the document's stylesheet, which is updated with the classes
+    the pane uses.  Everything else belongs to the render, so panes can be
+    rendered concurrently.
+    """
+
+    def __init__(self, renderer, css, cursor=(-1, -1)):
+        self.renderer = renderer
+        self.compact = renderer.compact
+        self.css = css
+        self.cursor_x, self.cursor_y = cursor
+        self.fg = None
+        self.bg = None
+        self.seq = ''
+        self.esc_style = []
+        self.column = 0
+        self.alt_charset = False
+
+    def update_css(self, prefix, color_code):
+        """Updates the CSS with a color."""
+        if color_code is None:
+            return ''
+        style = 'color' if prefix == 'f' else 'background-color'
+        seq_style = self.esc_style
+        if isinstance(color_code, int):
+            if prefix == 'f' and 1 in seq_style and color_code < 8:
+                color_code += 8
+            else:
+                seq_style = None
+            key = '{0}{1:d}'.format(prefix, color_code)
+        else:
+            if self.renderer.palette:
+                color_code = color.quantize(color_code, self.renderer.palette)
+            key = '{0}-rgb_{1}'.format(prefix, '_'.join(map(str_, color_code)))
+
+        self.css[key] = ':'.join((style, self.renderer.rgbhex(color_code,
+                                                              seq_style)))
+        return key
+
+    def dump(self):
+        """Get the colors and character set left by the rendered text."""
+        return {
+            'fg': self.fg,
+            'bg': self.bg,
+            'seq': self.seq,
+            'style': self.esc_style,
+            'alt_charset': self.alt_charset,
+        }
+
+    def load(self, data):
+        """Continue from the state of another render."""
+        self.fg = data['fg']
+        self.bg = data['bg']
+        self.seq = data['seq']
+        self.esc_style = list(data['style'])
+        self.alt_charset = data['alt_charset']
+
+    def glyph_run(self, s):
+        """Render glyphs in spans that are as many columns wide as the glyph.
+
+        Each glyph gets its own span so glyphs that are wider or narrower
+        than their columns in the font don't move the glyphs after them.
+        """
+        out = ''
+        for c in s:
+            width = utils.str_width(c)
+            key = 'w{:d}'.format(width)
+            self.css[key] = 'width:{:d}ch'.format(width)
+            out += '<span class="w {}">{}</span>'.format(key, escape(c))
+        return out
+
+
 class ChunkedLine(object):
-    def __init__(self, renderer, width=0, line=0):
-        self.col = renderer.column
+    def __init__(self, state, width=0, line=0):
+        self.col = state.column
         self.line = line
-        self.renderer = renderer
+        self.state = state
         self.width = width
         self.length = 0
         self.chunks = []
@@ -172,6 +256,9 @@ class ChunkedLine(object):
         span that will display the glyph using CSS.  This is to ensure that the
         text has a consistent width.
         """
+        if self.state.compact:
+            return self._escape_compact(s)
+
         tpl = ('<span class="u"><span class="g">&#x{0:x};</span>'
                '<span class="ns">{1}</span></span>')
         out = ''
@@ -185,6 +272,27 @@ class ChunkedLine(object):
                 out += escape(c)
         return out
 
+    def _escape_compact(self, s):
+        """Escape text, wrapping unicode characters in a single span.
+
+        Each unicode character is wrapped in a span with a fixed width in
+        columns.
+        """
+        out = ''
+        run = ''
+        for c in s:
+            if unicodedata.category(c) in ('Co', 'Cn', 'So') \
+                    or utils.str_width(c) > 1 or ord(c) > 255:
+                run += c
+                continue
+            if run:
+                out += self.state.glyph_run(run)
+                run = ''
+            out += escape(c)
+        if run:
+            out += self.state.glyph_run(run)
+        return out
+
     def open_tag(self, fg, bg, seq=None, tag='span', cls=None, styles=None):
         """Opens a tag.
 
@@ -198,16 +306,16 @@ class ChunkedLine(object):
             classes.append(cls)
 
         if styles is None:
-            styles = self.renderer.esc_style
+            styles = self.state.esc_style
 
         if 7 in styles:
             fg, bg = bg, fg
             classes.append('r')
 
-        k = self.renderer.update_css('f', fg)
+        k = self.state.update_css('f', fg)
         if k:
             classes.append(k)
-        k = self.renderer.update_css('b', bg)
+        k = self.state.update_css('b', bg)
         if k:
             classes.append(k)
 
@@ -253,13 +361,13 @@ class ChunkedLine(object):
         for i, c in enumerate(s):
             if ord(c) == 0x0e:
                 # Shift out to alternate character set
-                vt100_alt_charset['enabled'] = True
+                self.state.alt_charset = True
                 continue
             elif ord(c) == 0x0f:
                 # Shift back into standard character set
-                vt100_alt_charset['enabled'] = False
+                self.state.alt_charset = False
                 continue
-            elif vt100_alt_charset['enabled']:
+            elif self.state.alt_charset:
                 x = ord(c) % 16
                 y = ord(c) // 16 - 6
                 if x >= 0 and x < 16 and y >= 0 and y < 2:
@@ -272,20 +380,20 @@ class ChunkedLine(object):
 
             self.length += cw
 
-            if self.col + i == self.renderer.cursor_x \
-                    and self.line == self.renderer.cursor_y:
+            if self.col + i == self.state.cursor_x \
+                    and self.line == self.state.cursor_y:
                 self.chunks.append(self._escape_text(keep))
                 self.add_cursor(c)
-                self.renderer.column += len(keep) + 1
-                self.col = self.renderer.column
+                self.state.column += len(keep) + 1
+                self.col = self.state.column
                 keep = ''
                 continue
 
             keep += c
 
         if keep:
-            self.renderer.column += len(keep)
-            self.col = self.renderer.column
+            self.state.column += len(keep)
+            self.col = self.state.column
             self.chunks.append(self._escape_text(keep))
         return remainder
 
@@ -313,13 +421,21 @@ class ChunkedLine(object):
 
 
 class Separator(object):
-    def __init__(self, parent, size, vertical=True):
-        self.parent = parent
+    def __init__(self, state, size, vertical=True):
+        self.state = state
         self.size = size
         self.vertical = vertical
 
     def __str__(self):
-        if self.vertical:
+        if self.state.compact:
+            if self.vertical:
+                n = 1
+                rep = self.state.glyph_run('\u2500' * self.size[0])
+            else:
+                n = self.size[1]
+                rep = '<div>{}</div>'.format(
+                    self.state.glyph_run('\u2502'))
+        elif self.vertical:
             n = self.size[0]
             rep = ('<span class="u"><span class="g">&#x2500;</span>'
                    '<span class="ns"> </span></span>')
@@ -333,14 +449,28 @@ class Separator(object):
 
 
 class Renderer(object):
-    opened = 0
-    lines = []
-    css = {}
-    esc_style = []
+    """Renders tmux panes as HTML.
+
+    A renderer only holds its configuration.  The state of a render is kept
+    in the call, so a renderer can be used from multiple threads.
+
+    If `cache` is a `RenderCache`, snapshots reuse the HTML of panes that
+    didn't change.
 
-    def __init__(self, fg=(0xfa, 0xfa, 0xfa), bg=0):
+    If `palette` is set, true colors are reduced to a palette of at most that
+    many colors.  If `short_classes` is True, color classes are renamed to
+    short names once the document is rendered.
+    """
+
+    def __init__(self, fg=(0xfa, 0xfa, 0xfa), bg=0, assets=None,
+                 compact=False, cache=None, palette=0, short_classes=False):
         self.default_fg = fg
         self.default_bg = bg
+        self.assets = assets
+        self.compact = compact
+        self.cache = cache
+        self.palette = palette
+        self.short_classes = short_classes
 
     def rgbhex(self, c, style=None):
         """Converts a color to hex RGB."""
@@ -350,25 +480,7 @@ class Renderer(object):
             c = color.term_to_rgb(c, style)
         return '#{:02x}{:02x}{:02x}'.format(*c)
 
-    def update_css(self, prefix, color_code):
-        """Updates the CSS with a color."""
-        if color_code is None:
-            return ''
-        style = 'color' if prefix == 'f' else 'background-color'
-        seq_style = self.esc_style
-        if isinstance(color_code, int):
-            if prefix == 'f' and 1 in seq_style and color_code < 8:
-                color_code += 8
-            else:
-                seq_style = None
-            key = '{0}{1:d}'.format(prefix, color_code)
-        else:
-            key = '{0}-rgb_{1}'.format(prefix, '_'.join(map(str_, color_code)))
-
-        self.css[key] = ':'.join((style, self.rgbhex(color_code, seq_style)))
-        return key
-
-    def render_css(self):
+    def render_css(self, css):
         """Render stylesheet.
 
         If an item is a list or tuple, it is joined.
@@ -391,14 +503,23 @@ class Renderer(object):
                 'background-color:{fg}}}').format(**ctx)
 
         fmt = 'div.{prefix} pre span.{cls} {{{style};}}'
-        for k, v in self.css.items():
+        for k, v in css.items():
             out += fmt.format(prefix=classname, cls=k,
                               style=';'.join(v) if isinstance(v, (tuple, list)) else v)
         return out
 
-    def reset_css(self):
-        """Reset the CSS to the default state."""
-        self.css = {
+    def _short_classes(self, html, css):
+        """Rename the color classes in a document if enabled."""
+        if not self.short_classes:
+            return html, css
+        names = ClassNames(css)
+        names.count(html)
+        css = names.assign()
+        return names.rewrite(html), css
+
+    def base_css(self):
+        """Get a new stylesheet in the default state."""
+        return {
             'si': 'font-style:italic',
             'sb': 'font-weight:bold',
             'ns': [
@@ -413,22 +534,18 @@ class Renderer(object):
             ],
         }
 
-    def _render(self, s, size, max_lines=0):
-        """Render the content and return a Pane instance.
-        """
-        cur_fg = None
-        cur_bg = None
-        self.esc_style = []
-        pane = Pane(size, max_lines)
+    def _render_lines(self, state, lines, width, row):
+        """Render lines of content.
 
-        prev_seq = ''
-        lines = s.split('\n')
-        line_c = len(lines) - 1
-        for line_i, line in enumerate(lines):
-            self.column = 0
+        Yields a `(ChunkedLine, end)` tuple for each row, where `end` is True
+        if the row ends the line.  Lines longer than `width` are wrapped.
+        `row` is called to get the number of a new row.
+        """
+        for line in lines:
+            state.column = 0
             last_i = 0
-            chunk = ChunkedLine(self, size[0], len(pane))
-            chunk.open_tag(cur_fg, cur_bg, seq=prev_seq)
+            chunk = ChunkedLine(state, width, row())
+            chunk.open_tag(state.fg, state.bg, seq=state.seq)
             for m in re.finditer(r'\x1b\[([^m]*)m', line):
                 start, end = m.span()
                 seq = m.group(1)
@@ -439,113 +556,356 @@ class Renderer(object):
                     c = chunk.add_text(c)
                     if not c:
                         break
-                    pane.add_line(chunk)
-                    self.column = 0
-                    line_c += 1
-                    chunk = ChunkedLine(self, size[0], len(pane))
-                    chunk.open_tag(cur_fg, cur_bg, seq=prev_seq)
+                    yield chunk, False
+                    state.column = 0
+                    chunk = ChunkedLine(state, width, row())
+                    chunk.open_tag(state.fg, state.bg, seq=state.seq)
                 chunk.close_tag()
 
-                cur_fg, cur_bg = color.parse_escape(seq, fg=cur_fg, bg=cur_bg,
-                                                    style=self.esc_style)
+                state.fg, state.bg = color.parse_escape(
+                    seq, fg=state.fg, bg=state.bg, style=state.esc_style)
 
-                chunk.open_tag(cur_fg, cur_bg, seq=seq)
-                prev_seq = seq
+                chunk.open_tag(state.fg, state.bg, seq=seq)
+                state.seq = seq
 
             c = line[last_i:]
             if c:
                 if last_i == 0 and not chunk.tag_stack:
-                    chunk.open_tag(cur_fg, cur_bg, seq=prev_seq)
+                    chunk.open_tag(state.fg, state.bg, seq=state.seq)
                 while True:
                     c = chunk.add_text(c)
                     if not c:
                         break
-                    pane.add_line(chunk)
-                    self.column = 0
-                    line_c += 1
-                    chunk = ChunkedLine(self, size[0], len(pane))
-                    chunk.open_tag(cur_fg, cur_bg, seq=prev_seq)
+                    yield chunk, False
+                    state.column = 0
+                    chunk = ChunkedLine(state, width, row())
+                    chunk.open_tag(state.fg, state.bg, seq=state.seq)
                 chunk.close_tag()
-            if len(pane) < size[1] or (len(lines) > size[1] and len(pane) < line_c):
+            yield chunk, True
+
+    def _render(self, s, size, max_lines=0, cursor=(-1, -1), css=None):
+        """Render the content and return a Pane instance.
+
+        The classes used by the content are added to `css`.
+        """
+        if css is None:
+            css = self.base_css()
+        state = RenderState(self, css, cursor)
+        pane = Pane(size, max_lines)
+
+        lines = s.split('\n')
+        line_c = len(lines) - 1
+        for chunk, end in self._render_lines(state, lines, size[0],
+                                             lambda: len(pane)):
+            if not end:
+                pane.add_line(chunk)
+                line_c += 1
+            elif len(pane) < size[1] or (len(lines) > size[1] and len(pane) < line_c):
                 pane.add_line(chunk)
 
         while len(pane) < size[1] or (len(lines) > size[1] and len(pane) < line_c):
-            self.column = 0
-            pane.add_line(ChunkedLine(self, size[0], len(pane)))
+            state.column = 0
+            pane.add_line(ChunkedLine(state, size[0], len(pane)))
         return pane
 
-    def _update_cursor(self, pane):
-        self.cursor_x, self.cursor_y = utils.get_cursor(
-            '%{}'.format(pane.identifier))
-
-    def _render_pane(self, pane, empty=False, full=False, max_lines=0):
+    def _render_pane(self, pane, lines, css, empty=False, full=False,
+                     max_lines=0, rendered=None):
         """Recursively render a pane as HTML.
 
-        Panes without sub-panes are grouped.  Panes with sub-panes are grouped
-        by their orientation.
+        The HTML is appended to `lines`.  Panes without sub-panes are
+        grouped.  Panes with sub-panes are grouped by their orientation.  If
+        `rendered` is supplied, it's a dict of already rendered HTML for each
+        pane identifier.
         """
         if pane.panes:
             if pane.vertical:
-                self.lines.append('<div class="v">')
+                lines.append('<div class="v">')
             else:
-                self.lines.append('<div class="h">')
+                lines.append('<div class="h">')
             for i, p in enumerate(pane.panes):
                 if p.x != 0 and p.x > pane.x:
-                    self.lines.append(Separator(self, p.size, False))
+                    lines.append(Separator(RenderState(self, css), p.size,
+                                           False))
                 if p.y != 0 and p.y > pane.y:
-                    self.lines.append(Separator(self, p.size, True))
-                self._render_pane(p, empty, full=full, max_lines=max_lines)
+                    lines.append(Separator(RenderState(self, css), p.size,
+                                           True))
+                self._render_pane(p, lines, css, empty, full=full,
+                                  max_lines=max_lines, rendered=rendered)
 
-            self.lines.append('</div>')
+            lines.append('</div>')
         else:
-            self.lines.append('<div id="p{}" class="pane" data-w="{}" data-h="{}">'
-                              .format(pane.identifier, *pane.size))
-            if not empty:
-                vt100_alt_charset['enabled'] = False
-                self._update_cursor(pane)
-                pane = self._render(
-                    utils.get_contents('%{}'.format(pane.identifier),
-                                       full=full, max_lines=max_lines),
-                    pane.size, max_lines=max_lines)
-                self.lines.append(pane)
+            lines.append('<div id="p{}" class="pane" data-w="{}" data-h="{}">'
+                         .format(pane.identifier, *pane.size))
+            if rendered is not None:
+                lines.append(rendered[pane.identifier])
+            elif not empty:
+                target = '%{}'.format(pane.identifier)
+                lines.append(self._render_cached(
+                    utils.get_contents(target, full=full, max_lines=max_lines),
+                    pane.size, max_lines, tuple(utils.get_cursor(target)),
+                    css))
             else:
-                self.lines.append('<pre></pre>')
-            self.lines.append('</div>')
-
-    def render_pane(self, pane, script_reload=False, full=False, max_lines=0):
-        """Render a pane as HTML."""
-        self.lines = []
-        self.win_size = pane.size
-        self.reset_css()
-        self._render_pane(pane, full=full, max_lines=max_lines)
+                lines.append('<pre></pre>')
+            lines.append('</div>')
+
+    def _cache_key(self, content, size, max_lines, cursor):
+        return self.cache.key(content, size, max_lines, cursor,
+                              self.default_fg, self.default_bg, self.compact,
+                              self.palette)
+
+    def _render_cached(self, content, size, max_lines, cursor, css):
+        """Render content, reusing the cached HTML if there is a cache."""
+        if self.cache is None:
+            return self._render(content, size, max_lines=max_lines,
+                                cursor=cursor, css=css)
+
+        key = self._cache_key(content, size, max_lines, cursor)
+        entry = self.cache.get(key)
+        if entry is None:
+            pane_css = {}
+            html = str_(self._render(content, size, max_lines=max_lines,
+                                     cursor=cursor, css=pane_css))
+            entry = (html, pane_css)
+            self.cache.put(key, *entry)
+        css.update(entry[1])
+        return entry[0]
+
+    def _render_parallel(self, pane, css, jobs, full=False, max_lines=0):
+        """Render the leaf panes in a process pool.
+
+        All panes are captured first so the captures are as close together in
+        time as possible.  The CSS used by each pane is merged into `css` in
+        pane order so the stylesheet is the same as a sequential render's.
+        """
+        panes = utils.pane_list(pane)
+        tasks = []
+        results = {}
+        keys = {}
+        for p in panes:
+            target = '%{}'.format(p.identifier)
+            content = utils.get_contents(target, full=full,
+                                         max_lines=max_lines)
+            cursor = tuple(utils.get_cursor(target))
+            if self.cache is not None:
+                key = self._cache_key(content, p.size, max_lines, cursor)
+                entry = self.cache.get(key)
+                if entry is not None:
+                    results[p.identifier] = entry
+                    continue
+                keys[p.identifier] = key
+            tasks.append((p.identifier, (self.default_fg, self.default_bg,
+                                         self.compact, self.palette, content,
+                                         p.size, cursor, max_lines)))
+
+        if tasks:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+            try:
+                out = pool.map(_render_task, [x[1] for x in tasks])
+            finally:
+                pool.close()
+                pool.join()
+
+            for (identifier, _), entry in zip(tasks, out):
+                results[identifier] = entry
+                if self.cache is not None:
+                    self.cache.put(keys[identifier], *entry)
+
+        rendered = {}
+        for p in panes:
+            html, pane_css = results[p.identifier]
+            rendered[p.identifier] = html
+            css.update(pane_css)
+        return rendered
+
+    def render_pane(self, pane, script_reload=False, full=False, max_lines=0,
+                    jobs=1):
+        """Render a pane as HTML.
+
+        If `script_reload` is set, the page reloads the panes every that many
+        seconds.  The interval is also in the page's data so pages that are
+        already open pick up a new interval when they reload.
+
+        If `jobs` is greater than 1, the panes are rendered in that many
+        processes.
+        """
+        lines = []
+        css = self.base_css()
+        rendered = None
+        if jobs > 1 and len(utils.pane_list(pane)) > 1:
+            rendered = self._render_parallel(pane, css, jobs, full=full,
+                                             max_lines=max_lines)
+        self._render_pane(pane, lines, css, full=full, max_lines=max_lines,
+                          rendered=rendered)
+        if self.cache is not None:
+            self.cache.evict()
+        panes, css = self._short_classes(''.join(str_(x) for x in lines), css)
         script = ''
+        data = ''
         template = 'static.html'
         if script_reload:
             template = 'stream.html'
+            data = '<script type="text/tmux-interval">{}</script>'.format(
+                script_reload)
         elif full and (pane.identifier == -1 or max_lines):
             template = 'scroll.html'
-        return tpl.render(template, panes=''.join(str_(x) for x in self.lines),
-                          css=self.render_css(), prefix=classname,
+        return tpl.render(template, assets=self.assets, panes=panes,
+                          css=self.render_css(css), prefix=classname,
                           script=script, fg=self.rgbhex(self.default_fg),
-                          bg=self.rgbhex(self.default_bg), data='',
+                          bg=self.rgbhex(self.default_bg), data=data,
                           interval=script_reload)
 
-    def record(self, pane, interval, duration, window=None, session=None):
+    def render_ansi(self, text, size, cursor=(-1, -1)):
+        """Render text with ANSI escape sequences as HTML.
+
+        `size` is the `(width, height)` of the pane and `cursor` is the
+        `(x, y)` position of the cursor.  This doesn't run tmux, so it can be
+        used on text from anywhere.
+        """
+        css = self.base_css()
+        pane = self._render(text, size, cursor=cursor, css=css)
+        panes = '<div class="pane" data-w="{}" data-h="{}">{}</div>' \
+            .format(size[0], size[1], str_(pane))
+        panes, css = self._short_classes(panes, css)
+        return tpl.render('static.html', assets=self.assets, panes=panes,
+                          css=self.render_css(css), prefix=classname,
+                          script='', fg=self.rgbhex(self.default_fg),
+                          bg=self.rgbhex(self.default_bg), data='',
+                          interval=False)
+
+    def render_log(self, lines, size, hunk_lines=5000):
+        """Render lines of a log as a scrollable page.
+
+        `lines` can be any iterable, and the page is yielded in pieces as it's
+        rendered, so a log doesn't need to fit in memory.  History is
+        compressed in hunks of `hunk_lines` rows.  The stylesheet is only
+        known at the end, so it's added after the pane.
+        """
+        width, height = size
+        hunk_lines = max(hunk_lines, height + 1)
+        page = tpl.render('scroll.html', assets=self.assets, panes='\0',
+                          css='', prefix=classname, script='',
+                          fg=self.rgbhex(self.default_fg),
+                          bg=self.rgbhex(self.default_bg), data='',
+                          interval=False)
+        head, tail = page.split('\0', 1)
+        yield head
+        yield '<div class="pane" data-w="{}" data-h="{}">'.format(width,
+                                                                  height)
+
+        css = self.base_css()
+        state = RenderState(self, css)
+        rows = [0]
+        hunk = []
+        visible = deque(maxlen=height)
+
+        def row():
+            rows[0] += 1
+            return rows[0] - 1
+
+        for chunk, _ in self._render_lines(state, lines, width, row):
+            html = str_(chunk)
+            hunk.append(html)
+            visible.append(html)
+            if len(hunk) == hunk_lines:
+                yield '<script type="text/tmux-data">{}</script>'.format(
+                    ''.join(utils.compress_data('\n'.join(hunk))))
+                hunk = []
+
+        while rows[0] < height:
+            state.column = 0
+            visible.append(str_(ChunkedLine(state, width, row())))
+        if hunk and rows[0] > height:
+            yield '<script type="text/tmux-data">{}</script>'.format(
+                ''.join(utils.compress_data('\n'.join(hunk))))
+        yield '<pre>{}</pre></div>'.format(''.join(visible))
+        yield '<style>{}</style>'.format(self.render_css(css))
+        yield tail
+
+    def render_rows(self, lines, width, css, state=None, row=0,
+                    cursor=(-1, -1)):
+        """Render lines as rows that continue an earlier render.
+
+        `state` is from `RenderState.dump()` of the earlier render and `row`
+        is the number of rows it had.  Returns the rows' HTML and the state
+        after them.
+        """
+        render = RenderState(self, css, (cursor[0], cursor[1] + row))
+        if state:
+            render.load(state)
+        rows = [row]
+
+        def next_row():
+            rows[0] += 1
+            return rows[0] - 1
+
+        html = [str_(chunk) for chunk, _ in
+                self._render_lines(render, lines, width, next_row)]
+        return html, render.dump()
+
+    def history_page(self, blocks, screen, size, css):
+        """Render a scrollable page from blocks of history and the screen.
+
+        `blocks` are compressed history rows and `screen` is the HTML of the
+        visible rows.
+        """
+        data = blocks + [''.join(utils.compress_data('\n'.join(screen)))]
+        panes = '<div class="pane" data-w="{}" data-h="{}"><pre>{}</pre>{}' \
+            '</div>'.format(size[0], size[1], ''.join(screen), ''.join(
+                '<script type="text/tmux-data">{}</script>'.format(x)
+                for x in data))
+        return tpl.render('scroll.html', assets=self.assets, panes=panes,
+                          css=self.render_css(css), prefix=classname,
+                          script='', fg=self.rgbhex(self.default_fg),
+                          bg=self.rgbhex(self.default_bg), data='',
+                          interval=False)
+
+    def capture(self, pane, duration=0, window=None, session=None,
+                scheduler=None, watcher=None, css=None):
+        """Capture frames until `duration` elapses or capturing is interrupted.
+
+        Panes are polled on the `scheduler`'s ticks.  If a `watcher` is
+        supplied, panes are captured when they produce output instead, and
+        polling only catches changes that don't produce output (e.g. layout
+        changes and scrolling in copy mode).
+
+        This is a generator that yields a frame for each tick.  Ticks that
+        didn't capture any changes yield None.  The last frame is a frame
+        without content that spans the time since the last change.
+
+        The cursor isn't rendered into the rows.  Frames have a `cursor`
+        with the position of each pane's cursor when it changes, or
+        `[-1, -1]` if it's hidden.
+
+        The classes used by the frames are added to `css`.
+        """
+        if scheduler is None:
+            scheduler = Scheduler(0.5)
+        if css is None:
+            css = self.base_css()
         panes = []
-        frames = []
-        start = time.time()
+        start = scheduler.start()
         changes = defaultdict(dict)
+        cursors = {}
         frame = defaultdict(dict)
+        cursor = {}
         last_frame = start
         frame_sizes = tuple()
+        batch = {}
 
         while True:
             try:
-                n = time.time()
+                n = monotonic()
                 if duration and n - start >= duration:
                     break
 
+                if batch:
+                    # Date the frame by when the output happened rather than
+                    # when the capture happened.
+                    n = min(batch.values())
+
                 frame.clear()
+                cursor.clear()
+                reset = None
                 new_pane, new_panes, new_frame_sizes = \
                     utils.update_pane_list(pane, window, session, ignore_error=True)
 
@@ -553,30 +913,36 @@ class Renderer(object):
                         or frame_sizes != new_frame_sizes \
                         or hash(tuple(panes)) != hash(tuple(new_panes)):
                     changes.clear()
-                    self.lines[:] = []
-                    self.win_size = new_pane.size
-                    self._render_pane(new_pane, empty=True)
-                    containers = ''.join(str_(x) for x in self.lines)
-                    frames.append({
+                    cursors.clear()
+                    lines = []
+                    self._render_pane(new_pane, lines, css, empty=True)
+                    containers = ''.join(str_(x) for x in lines)
+                    reset = {
                         'delay': 0,
                         'reset': True,
                         'layout': containers,
-                    })
+                    }
+                    batch = {}
+                    if watcher:
+                        watcher.attach(p.identifier for p in new_panes)
 
                 pane = new_pane
                 panes = new_panes
                 frame_sizes = new_frame_sizes
 
                 for p in panes:
-                    self.opened = 0
-                    self.lines = []
-                    self.win_size = p.size
+                    if batch and p.identifier not in batch:
+                        continue
                     content = utils.get_contents('%{}'.format(p.identifier))
                     if not content:
                         continue
 
-                    self._update_cursor(p)
-                    rendered = self._render(content, p.size)
+                    pos = list(utils.get_cursor('%{}'.format(p.identifier)))
+                    if cursors.get(p.identifier) != pos:
+                        cursors[p.identifier] = pos
+                        cursor[p.identifier] = pos
+
+                    rendered = self._render(content, p.size, css=css)
 
                     if p.dimensions not in changes:
                         changes[p.dimensions] = {}
@@ -589,44 +955,141 @@ class Renderer(object):
                             ch_pane[lc.line] = line_str
                             frame[p.identifier][lc.line] = line_str
 
-                if frame:
-                    n += (time.time() - n)
-                    frames.append({
-                        'delay': max(0, n - last_frame),
-                        'lines': frame.copy(),
-                    })
+                if reset:
+                    yield reset
+
+                if frame or cursor:
+                    out = {'delay': max(0, n - last_frame)}
+                    if frame:
+                        out['lines'] = dict(frame)
+                    if cursor:
+                        out['cursor'] = dict(cursor)
+                    yield out
                     last_frame = n
-                time.sleep(interval)
+                elif not reset:
+                    yield None
+
+                active = bool(frame or cursor)
+                if watcher:
+                    scheduler.adapt(active)
+                    batch = watcher.wait(scheduler.interval)
+                else:
+                    scheduler.wait(active)
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 print('Stopped recording due to an encountered error: %s' % e)
                 break
 
-        # Close the loop
-        if len(frames) > 2:
-            n = time.time()
-            frames.append({
-                'delay': n - last_frame,
-            })
-            frame.clear()
+        if watcher:
+            watcher.close()
+
+        report = scheduler.report()
+        if report:
+            print(report)
 
-        str_data = []
+        yield {
+            'delay': monotonic() - last_frame,
+        }
+
+    def encode(self, frames, encoder=None, css=None):
+        """Encode frames as an animation.
 
-        first, frames = frames[:50], frames[50:]
-        str_data.append('<script type="text/tmux-data">{}</script>'
-                        .format(''.join(utils.compress_data(json.dumps(first)))))
+        `css` is the stylesheet the frames were captured with.
+        """
+        if css is None:
+            css = self.base_css()
+        if encoder is None:
+            encoder = Encoder()
+        frames = list(encoder.encode(frames))
+        if self.short_classes:
+            css, frames = ClassNames(css).frames(frames)
+        hunks = [''.join(utils.compress_data(x)) for x in chunks(frames)]
+        return self._animation(hunks, css, encoder.index,
+                               first_frame(frames[:2]))
+
+    def _animation(self, hunks, css, index=None, panes=''):
+        """Render an animation from its compressed chunks of frames.
+
+        `panes` is the markup of the first frame.
+        """
+        str_data = ['<script type="text/tmux-data">{}</script>'.format(x)
+                    for x in hunks]
 
-        for i in range(0, len(frames), 500):
+        if index is not None:
             str_data.append(
-                '<script type="text/tmux-data">{}</script>'
-                .format(''.join(utils.compress_data(json.dumps(frames[i:i+500])))))
+                '<script type="text/tmux-index">{}</script>'
+                .format(''.join(utils.compress_data(
+                    json.dumps(index.dump())))))
 
-        return tpl.render('animation.html', panes='', css=self.render_css(),
+        return tpl.render('animation.html', assets=self.assets, panes=panes,
+                          css=self.render_css(css),
                           prefix=classname, data='\n'.join(str_data),
                           fg=self.rgbhex(self.default_fg),
                           bg=self.rgbhex(self.default_bg))
 
+    def record(self, pane, interval, duration, window=None, session=None,
+               scheduler=None, watcher=None, encoder=None):
+        """Record an animation.
+
+        See `capture()` for the arguments.  The frames are encoded with
+        `encoder` and compressed in the background while recording.  With
+        short class names, the class names can only be assigned once all of
+        the frames are known, so the frames are compressed after recording
+        stops.
+        """
+        if scheduler is None:
+            scheduler = Scheduler(interval)
+        if encoder is None:
+            encoder = Encoder()
+        css = self.base_css()
+        pipeline = Pipeline(encoder, compress=not self.short_classes)
+        last = None
+        count = 0
+        frames = self.capture(pane, duration, window, session, scheduler,
+                              watcher, css)
+        try:
+            for frame in frames:
+                if frame:
+                    # The last frame is held back until it's known whether
+                    # it's the closing frame.
+                    if last is not None:
+                        pipeline.add(last)
+                        count += 1
+                    last = frame
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # The capture doesn't get to stop the watcher if encoding fails.
+            frames.close()
+            if watcher:
+                watcher.close()
+
+        # Close the loop.  The closing frame is only needed if there's
+        # something to animate.
+        if last is not None and (list(last) != ['delay'] or count > 2):
+            pipeline.add(last)
+
+        hunks = pipeline.finish()
+        head = pipeline.head
+        if self.short_classes:
+            css, frames = ClassNames(css).frames(hunks)
+            hunks = [''.join(utils.compress_data(x)) for x in chunks(frames)]
+            head = frames[:2]
+        return self._animation(hunks, css, encoder.index, first_frame(head))
+
+
+def _render_task(args):
+    """Render a captured pane in a worker process.
+
+    Returns the pane's HTML and the CSS it used.
+    """
+    fg, bg, compact, palette, content, size, cursor, max_lines = args
+    r = Renderer(fg, bg, compact=compact, palette=palette)
+    css = {}
+    return str_(r._render(content, size, max_lines=max_lines, cursor=cursor,
+                          css=css)), css
+
 
 def color_type(val):
     parts = tuple(map(int, val.split(',')))
@@ -648,82 +1111,279 @@ def sil_int(val):
         return 0
 
 
-def atomic_output(output, filename=None, mode=0o0644, quiet=False):
+def _unchanged(filename, data, mode):
+    """Check if a file already has the same content and permissions."""
+    try:
+        st = os.stat(filename)
+        if st.st_size != len(data) or stat.S_IMODE(st.st_mode) != mode:
+            return False
+        with open(filename, 'rb') as fp:
+            return fp.read() == data
+    except (IOError, OSError):
+        return False
+
+
+def _gz_unchanged(filename, data, mode):
+    """Check if a gzip file has the same content and permissions.
+
+    Only the CRC and size in the file's trailer are compared, so it isn't
+    decompressed.
+    """
+    try:
+        if stat.S_IMODE(os.stat(filename).st_mode) != mode:
+            return False
+        with open(filename, 'rb') as fp:
+            fp.seek(-8, os.SEEK_END)
+            crc, size = struct.unpack('<II', fp.read(8))
+    except (IOError, OSError, struct.error):
+        return False
+    return crc == zlib.crc32(data) & 0xffffffff \
+        and size == len(data) & 0xffffffff
+
+
+def _remove_gz(gz_name):
+    """Remove a compressed copy left by an earlier run with `gz`."""
+    try:
+        os.unlink(gz_name)
+    except OSError:
+        pass
+
+
+def atomic_output(output, filename=None, mode=0o0644, quiet=False, gz=False,
+                  chunk_size=65536):
+    """Write the output to a temporary file and rename it to `filename`.
+
+    If `gz` is True, a gzip compressed copy is written to `filename`.gz for
+    web servers that serve precompressed files.  It's compressed while the
+    output is being written and renamed into place just before the
+    uncompressed file.  If `gz` is False, a compressed copy left by an
+    earlier run is removed so it can't be served instead of the new output.
+    Nothing is written if the content and permissions of both files didn't
+    change.
+
+    `output` can also be an iterable of strings, which are written as they're
+    produced.  If producing or writing it fails, the temporary files are
+    removed and the error is raised.
+    """
     if filename:
+        gz_name = filename + '.gz'
+        if isinstance(output, str_):
+            data = output.encode('utf8')
+            if _unchanged(filename, data, mode) \
+                    and (not gz or _gz_unchanged(gz_name, data, mode)):
+                if not gz:
+                    _remove_gz(gz_name)
+                if not quiet:
+                    print('HTML unchanged: {}'.format(filename))
+                return
+            hunks = (data[i:i+chunk_size]
+                     for i in range(0, len(data), chunk_size))
+        else:
+            hunks = (x.encode('utf8') for x in output)
+
         tmp = None
+        gz_tmp = None
         try:
             tmp = tempfile.NamedTemporaryFile(prefix='tmp2html.',
                                               dir=os.path.dirname(filename),
                                               delete=False)
-            tmp.write(output.encode('utf8'))
+            gz_fp = None
+            if gz:
+                gz_tmp = tempfile.NamedTemporaryFile(
+                    prefix='tmp2html.', dir=os.path.dirname(filename),
+                    delete=False)
+                gz_fp = gzip.GzipFile(filename=os.path.basename(filename),
+                                      mode='wb', fileobj=gz_tmp, mtime=0)
+            for hunk in hunks:
+                tmp.write(hunk)
+                if gz_fp:
+                    gz_fp.write(hunk)
+            if gz_fp:
+                gz_fp.close()
+                gz_tmp.flush()
+                os.fsync(gz_tmp.fileno())
             tmp.flush()
             os.fsync(tmp.fileno())
-        except IOError as e:
-            print(e)
-        except Exception:
-            pass
-        finally:
-            if tmp:
-                tmp.close()
-                os.chmod(tmp.name, mode)
-                os.rename(tmp.name, filename)
-                if not quiet:
-                    print('Wrote HTML to: {}'.format(filename))
-    else:
+        except BaseException:
+            # Nothing is renamed into place if the output couldn't be
+            # produced or written in full.
+            for fp in (gz_tmp, tmp):
+                if fp:
+                    fp.close()
+                    os.unlink(fp.name)
+            raise
+
+        if gz_tmp:
+            gz_tmp.close()
+            os.chmod(gz_tmp.name, mode)
+            os.rename(gz_tmp.name, gz_name)
+        else:
+            _remove_gz(gz_name)
+        tmp.close()
+        os.chmod(tmp.name, mode)
+        os.rename(tmp.name, filename)
+        if not quiet:
+            print('Wrote HTML to: {}'.format(filename))
+    elif isinstance(output, str_):
         print(output.encode('utf8'))
+    else:
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        for x in output:
+            stdout.write(x.encode('utf8'))
 
 
 def main():
     parser = argparse.ArgumentParser(description='Render tmux panes as HTML')
-    parser.add_argument('target', default='', help='Target window or pane')
+    parser.add_argument('target', nargs='?', default='',
+                        help='Target window or pane')
     parser.add_argument('-o', '--output', default='',
                         help='Output file, required with --stream')
     parser.add_argument('-m', '--mode', default='644',
                         type=lambda x: int(x, 8), help='Output file permissions')
+    parser.add_argument('--assets', default='',
+                        help='Directory to write the shared stylesheet and '
+                        'scripts to instead of inlining them')
+    parser.add_argument('--assets-url', default=None,
+                        help='URL the shared assets are served from (default: '
+                        'path to --assets relative to --output)')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Also write a gzip compressed copy of the output '
+                        'file for web servers that serve precompressed files')
+    parser.add_argument('--compact', action='store_true',
+                        help='Render unicode glyphs as one element each '
+                        'instead of two for smaller output')
     parser.add_argument('--light', action='store_true', help='Light background')
     parser.add_argument('--stream', action='store_true',
                         help='Continuously renders until stopped and adds a '
                         'script to auto refresh based on --interval')
     parser.add_argument('--interval', default=0.5, type=float,
                         help='Number of seconds between captures')
+    parser.add_argument('--min-interval', default=None, type=float,
+                        help='Interval to return to when there is activity '
+                        '(default: --interval)')
+    parser.add_argument('--max-interval', default=None, type=float,
+                        help='Interval to back off to when panes are idle or '
+                        'the host is loaded (default: --interval, which '
+                        'doesn\'t back off)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Capture panes when they produce output instead '
+                        'of polling (uses tmux pipe-pane)')
+    parser.add_argument('--debounce', default=0.05, type=float,
+                        help='Seconds of quiet to wait for after output '
+                        'before capturing with --watch')
+    parser.add_argument('--max-latency', default=None, type=float,
+                        help='Maximum seconds between output and its capture '
+                        'with --watch (default: --interval)')
     parser.add_argument('--duration', default=-1, type=float,
                         help='Number of seconds to capture (0 for indefinite, '
                         '-1 to disable, ignored with --stream)')
+    parser.add_argument('--max-idle', default=0, type=float,
+                        help='Maximum seconds between frames in animations')
+    parser.add_argument('--min-frame-delay', default=0, type=float,
+                        help='Merge frames that are closer together than '
+                        'this many seconds in animations')
+    parser.add_argument('--coalesce', default=0, type=float,
+                        help='Merge frames that only change the same rows '
+                        'within this many seconds in animations')
+    parser.add_argument('--palette', default=0, type=int,
+                        help='Reduce true colors to a palette of at most '
+                        'this many colors (8 or more)')
+    parser.add_argument('--short-classes', action='store_true',
+                        help='Use short names for color classes and merge '
+                        'colors that are always used together')
+    parser.add_argument('--index', action='store_true',
+                        help='Add a search index to animations')
+    parser.add_argument('--flight', default=0, type=float,
+                        help='Record indefinitely, keeping only the last '
+                        'FLIGHT seconds.  They are written to --output '
+                        '(strftime formatted) on SIGUSR1')
+    parser.add_argument('--flight-key', default='',
+                        help='tmux key to bind for writing the flight '
+                        'recording')
+    parser.add_argument('--flight-frames', default=10000, type=int,
+                        help='Maximum number of frames to keep when flight '
+                        'recording')
+    parser.add_argument('--flight-mb', default=32, type=float,
+                        help='Maximum megabytes of markup to keep when flight '
+                        'recording')
+    parser.add_argument('--fleet', action='store_true',
+                        help='Record every window of every session.  The '
+                        'output file name can use {session}, {window} and '
+                        '{id}.  --duration rotates the recordings (default: '
+                        'every hour)')
+    parser.add_argument('--fleet-jobs', default=8, type=int,
+                        help='Maximum tmux commands to run at once with '
+                        '--fleet')
     parser.add_argument('--fg', type=color_type, default=None,
                         help='Foreground color')
     parser.add_argument('--bg', type=color_type, default=None,
                         help='Background color')
+    parser.add_argument('--jobs', default=1, type=int,
+                        help='Number of processes to render panes with '
+                        '(snapshots only)')
+    parser.add_argument('--cache', default='',
+                        help='Directory to cache rendered panes in '
+                        '(snapshots only)')
+    parser.add_argument('--cache-mb', default=64, type=float,
+                        help='Maximum size of the --cache directory in MB')
     parser.add_argument('--full', action='store_true',
                         help='Renders the full history of a single pane')
     parser.add_argument('--history', type=int, default=0,
                         help='Specifies the maximum number of pane history '
                         'lines to include (implies --full)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only render the history added since the last '
+                        'run and add it to the output (implies --full).  A '
+                        'checkpoint is kept in OUTPUT.checkpoint')
+    parser.add_argument('--input', default='',
+                        help='Render a saved log with ANSI colors instead of '
+                        'a pane (- for stdin)')
+    parser.add_argument('--width', default=80, type=int,
+                        help='Pane width for --input')
+    parser.add_argument('--height', default=24, type=int,
+                        help='Pane height for --input')
     args = parser.parse_args()
 
     if args.interval <= 0:
         print('Interval must be positive non-zero')
         sys.exit(1)
 
-    window = args.target
-    pane = None
-    session = None
-    if window.find(':') != -1:
-        session, window = window.split(':', 1)
+    if args.min_interval is None:
+        args.min_interval = args.interval
+    if args.max_interval is None:
+        args.max_interval = max(args.interval, args.min_interval)
 
-    if window.find('.') != -1:
-        window, pane = window.split('.', 1)
-        window = sil_int(window)
-        pane = sil_int(pane)
-    else:
-        window = sil_int(window)
+    if args.min_interval <= 0 or args.max_interval < args.min_interval:
+        print('Intervals must be positive and --max-interval must not be '
+              'less than --min-interval')
+        sys.exit(1)
+
+    if args.palette and args.palette < 8:
+        print('--palette must be at least 8 colors')
+        sys.exit(1)
+
+    target_pane = window = session = None
+    if not args.fleet and not args.input:
+        window = args.target
+        pane = None
+        session = None
+        if window.find(':') != -1:
+            session, window = window.split(':', 1)
+
+        if window.find('.') != -1:
+            window, pane = window.split('.', 1)
+            window = sil_int(window)
+            pane = sil_int(pane)
+        else:
+            window = sil_int(window)
 
-    root = utils.get_layout(window, session)
-    target_pane = root
-    if isinstance(pane, int):
-        panes = utils.pane_list(root)
-        target_pane = panes[pane]
+        root = utils.get_layout(window, session)
+        target_pane = root
+        if isinstance(pane, int):
+            panes = utils.pane_list(root)
+            target_pane = panes[pane]
 
-    args.full = args.full or args.history > 0
+    args.full = args.full or args.history > 0 or args.incremental
 
     if args.full:
         try:
@@ -736,6 +1396,10 @@ def main():
             if args.stream:
                 raise IncompatibleOptionError('Streaming is not allowed in '
                                               'full history renders')
+            if args.flight:
+                raise IncompatibleOptionError('Flight recording is not '
+                                              'allowed in full history '
+                                              'renders')
         except IncompatibleOptionError as e:
             print(e)
             sys.exit(1)
@@ -755,7 +1419,75 @@ def main():
     if args.bg:
         bg = args.bg
 
-    r = Renderer(fg, bg)
+    assets = None
+    if args.assets:
+        url = args.assets_url
+        if url is None:
+            url = os.path.relpath(args.assets,
+                                  os.path.dirname(args.output) or '.')
+            url = url.replace(os.sep, '/')
+        assets = (args.assets, url)
+
+    cache = None
+    if args.cache and not args.stream:
+        # Streams render every tick, so the cache's lookups and eviction
+        # would cost more than they save.
+        cache = RenderCache(args.cache, int(args.cache_mb * 1024 * 1024))
+
+    r = Renderer(fg, bg, assets=assets, compact=args.compact, cache=cache,
+                 palette=args.palette, short_classes=args.short_classes)
+
+    def new_encoder():
+        return Encoder(args.max_idle, args.min_frame_delay, args.coalesce,
+                       SearchIndex() if args.index else None)
+
+    if args.input:
+        if args.stream or args.duration > 0 or args.flight or args.fleet:
+            print('--input can\'t be used with --stream, --flight, --fleet, '
+                  'or animations')
+            sys.exit(1)
+        try:
+            fp = logfile.open_log(args.input)
+        except IOError as e:
+            print(e)
+            sys.exit(1)
+        try:
+            atomic_output(r.render_log(logfile.log_lines(fp),
+                                       (args.width, args.height)),
+                          args.output, mode=args.mode, gz=args.gzip)
+        except IOError as e:
+            print(e)
+            sys.exit(1)
+        finally:
+            if args.input != '-':
+                fp.close()
+        return
+
+    if args.fleet:
+        if sys.version_info < (3, 5):
+            print('--fleet requires Python 3.5 or newer')
+            sys.exit(1)
+        if not args.output or args.stream or args.flight or args.full:
+            print('--fleet requires an output file and can\'t be used with '
+                  '--stream, --flight, or full history renders')
+            sys.exit(1)
+
+        from . import fleet
+
+        def write(output, filename):
+            atomic_output(output, filename, mode=args.mode, gz=args.gzip)
+
+        rotate = args.duration
+        if rotate <= 0:
+            rotate = fleet.default_rotate
+        print('Recording all windows.  Press Ctrl-C to stop.')
+        if fleet.record(fleet.Fleet(r, args.output, write, new_encoder,
+                                    interval=args.interval, rotate=rotate,
+                                    jobs=args.fleet_jobs)):
+            sys.exit(1)
+        return
+
+    scheduler = Scheduler(args.interval, args.min_interval, args.max_interval)
 
     if args.stream:
         if not args.output:
@@ -767,22 +1499,95 @@ def main():
         target_panes = []
         target_frame_sizes = tuple()
         last_output = ''
+        last_interval = args.interval
+        watcher = None
+        if args.watch:
+            watcher = PaneWatcher(args.debounce,
+                                  args.max_latency or args.interval)
+        scheduler.start()
         while True:
             try:
+                changed = False
                 new_pane, new_panes, new_frame_sizes = \
                     utils.update_pane_list(target_pane, window, session)
+                if watcher:
+                    watcher.attach(p.identifier for p in new_panes)
                 if target_pane.dimensions != new_pane.dimensions \
                         or target_frame_sizes != new_frame_sizes \
                         or hash(tuple(target_panes)) != hash(tuple(new_panes)):
-                    output = r.render_pane(target_pane, script_reload=args.interval)
+                    # Pages reload at the current interval so they don't poll
+                    # more often than the output is written.
+                    interval = scheduler.interval
+                    output = r.render_pane(target_pane,
+                                           script_reload=interval)
                     if output != last_output:
+                        changed = True
+                        if interval != last_interval:
+                            # A new interval alone isn't activity.
+                            changed = r.render_pane(
+                                target_pane,
+                                script_reload=last_interval) != last_output
                         last_output = output
-                        atomic_output(output, args.output, quiet=True,
-                                      mode=args.mode)
-                time.sleep(args.interval)
+                        last_interval = interval
+                        try:
+                            atomic_output(output, args.output, quiet=True,
+                                          mode=args.mode, gz=args.gzip)
+                        except (IOError, OSError) as e:
+                            print(e)
+                if watcher:
+                    scheduler.adapt(changed)
+                    watcher.wait(scheduler.interval)
+                else:
+                    scheduler.wait(changed)
             except KeyboardInterrupt:
                 break
 
+        if watcher:
+            watcher.close()
+
+        report = scheduler.report()
+        if report:
+            print(report)
+        return
+
+    if args.flight:
+        if not args.output or args.stream:
+            print('Flight recording requires an output file and can\'t be '
+                  'used with --stream')
+            sys.exit(1)
+
+        css = r.base_css()
+
+        def dump(frames):
+            try:
+                atomic_output(r.encode(frames, new_encoder(), css),
+                              time.strftime(args.output),
+                              mode=args.mode, gz=args.gzip)
+            except (IOError, OSError) as e:
+                print(e)
+
+        if args.flight_key:
+            flight.bind_key(args.flight_key)
+        print('Flight recording the last {0:0.0f} seconds.  Send SIGUSR1 to '
+              'process {1:d}{2} to write them.\nPress Ctrl-C to stop.'
+              .format(args.flight, os.getpid(),
+                      ' or press ' + args.flight_key if args.flight_key else ''))
+        watcher = None
+        if args.watch:
+            watcher = PaneWatcher(args.debounce,
+                                  args.max_latency or args.interval)
+        buffer = flight.FrameBuffer(args.flight, args.flight_frames,
+                                    int(args.flight_mb * 1024 * 1024))
+        frames = r.capture(target_pane, 0, window, session, scheduler,
+                           watcher, css)
+        try:
+            flight.record(frames, buffer, dump)
+        finally:
+            frames.close()
+            if watcher:
+                watcher.close()
+            if args.flight_key:
+                flight.unbind_key(args.flight_key)
         return
 
     if args.duration != -1:
@@ -791,10 +1596,32 @@ def main():
         else:
             print('Recording for {:0.2f} seconds.  Press Ctrl-C to stop.'
                   .format(args.duration))
+        watcher = None
+        if args.watch:
+            watcher = PaneWatcher(args.debounce,
+                                  args.max_latency or args.interval)
         output = r.record(target_pane, args.interval, args.duration, window,
-                          session)
+                          session, scheduler=scheduler, watcher=watcher,
+                          encoder=new_encoder())
+    elif args.incremental:
+        if not args.output or target_pane.panes or args.short_classes:
+            print('Incremental history requires an output file and a single '
+                  'pane, and can\'t be used with --short-classes')
+            sys.exit(1)
+
+        def write(output):
+            atomic_output(output, args.output, mode=args.mode, gz=args.gzip)
+
+        n = history.export(r, '%{}'.format(target_pane.identifier),
+                           args.output, write, max_lines=args.history)
+        print('Added {} rows of history'.format(n))
+        return
     else:
         output = r.render_pane(target_pane, full=args.full,
-                               max_lines=args.history)
+                               max_lines=args.history, jobs=args.jobs)
 
-    atomic_output(output, args.output, mode=args.mode)
+    try:
+        atomic_output(output, args.output, mode=args.mode, gz=args.gzip)
+    except (IOError, OSError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,124 @@
+# coding: utf8
+"""Capture scheduling.
+
+Captures are scheduled on absolute deadlines using a monotonic clock so the
+time spent capturing and rendering doesn't add up as drift.
+"""
+from __future__ import division
+
+import os
+import time
+import multiprocessing
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class Scheduler(object):
+    """Schedules capture ticks.
+
+    The interval adapts between `min_interval` and `max_interval`.  It backs
+    off while nothing changes or the host is loaded, and snaps back to
+    `min_interval` as soon as there is activity.
+
+    When a tick takes longer than the interval, the missed deadlines are
+    dropped and the next tick starts immediately.  This is counted as an
+    overrun.
+    """
+    backoff = 1.5
+    idle_ticks = 2
+    load_check = 1.0
+
+    def __init__(self, interval, min_interval=None, max_interval=None):
+        self.min_interval = min_interval or interval
+        self.max_interval = max(max_interval or interval, self.min_interval)
+        self.interval = min(self.max_interval,
+                            max(self.min_interval, interval))
+        self.cpus = _cpu_count()
+        self.started = None
+        self.deadline = None
+        self.idle = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.max_lag = 0.0
+        self._loaded = False
+        self._load_checked = 0
+
+    def start(self):
+        """Start the clock.  Returns the current monotonic time."""
+        self.started = self.deadline = monotonic()
+        return self.started
+
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def is_loaded(self):
+        """Check if the load average exceeds the number of CPUs.
+
+        The load average is only checked once every `load_check` seconds.
+        """
+        n = monotonic()
+        if n - self._load_checked >= self.load_check:
+            self._load_checked = n
+            try:
+                self._loaded = os.getloadavg()[0] > self.cpus
+            except (AttributeError, OSError):
+                self._loaded = False
+        return self._loaded
+
+    def adapt(self, active, overrun=False):
+        """Adjust the interval based on the activity of the last tick."""
+        if overrun or self.is_loaded():
+            self.interval = min(self.max_interval,
+                                self.interval * self.backoff)
+        elif active:
+            self.idle = 0
+            self.interval = self.min_interval
+        else:
+            self.idle += 1
+            if self.idle >= self.idle_ticks:
+                self.interval = min(self.max_interval,
+                                    self.interval * self.backoff)
+
+    def wait(self, active=True):
+        """Wait for the next tick.
+
+        `active` indicates whether the last tick captured any changes.
+        Returns the number of seconds the tick overran its deadline, or 0.
+        """
+        if self.deadline is None:
+            self.start()
+
+        self.ticks += 1
+        n = monotonic()
+        lag = n - (self.deadline + self.interval)
+        self.adapt(active, lag > 0)
+
+        if lag > 0:
+            self.overruns += 1
+            self.max_lag = max(self.max_lag, lag)
+            self.deadline = n
+            return lag
+
+        self.deadline += self.interval
+        delay = self.deadline - monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return 0
+
+    def report(self):
+        """Summary of overruns, or an empty string if there were none."""
+        if not self.overruns:
+            return ''
+        return ('Captures overran their interval {0:d} of {1:d} times '
+                '(worst: {2:0.3f}s)'.format(self.overruns, self.ticks,
+                                            self.max_lag))
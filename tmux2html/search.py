@@ -0,0 +1,90 @@
+# coding: utf8
+"""Text search over recorded frames.
+
+The index maps tokens to the places they appeared: when a token shows up in
+a row that didn't have it before, the frame, pane, and row are recorded.
+This makes it possible to jump to the moment text appeared without replaying
+the recording.
+"""
+import re
+
+try:
+    from html import unescape
+except ImportError:
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+
+
+_tag_re = re.compile(r'<[^>]*>')
+_token_re = re.compile(r'[a-z0-9_]+')
+
+min_token = 2
+
+
+def plain_text(html):
+    """Get the text of a row's HTML."""
+    return unescape(_tag_re.sub('', html))
+
+
+def tokens(text):
+    """Split text into lower case tokens.
+
+    Only ASCII letters, digits, and underscores make up tokens so the player
+    can split queries the same way.
+    """
+    return set(x for x in _token_re.findall(text.lower())
+               if len(x) >= min_token)
+
+
+class SearchIndex(object):
+    """An inverted index of the tokens in recorded frames.
+
+    Postings are `(frame, pane, row)` where `frame` is the index of the frame
+    in the recording.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.rows = {}
+
+    def add(self, n, frame):
+        """Index the rows changed by frame number `n`."""
+        if frame.get('reset'):
+            self.rows = {}
+        for pane, rows in frame.get('lines', {}).items():
+            for row, html in rows.items():
+                key = (pane, row)
+                new = tokens(plain_text(html))
+                for token in sorted(new - self.rows.get(key, set())):
+                    self.postings.setdefault(token, []).append((n, pane, row))
+                self.rows[key] = new
+
+    def scan(self, frames):
+        """Index frames as they pass through."""
+        for n, frame in enumerate(frames):
+            self.add(n, frame)
+            yield frame
+
+    def search(self, query):
+        """Get the postings where the query's tokens appeared together."""
+        result = None
+        for token in tokens(query):
+            found = set(self.postings.get(token, ()))
+            result = found if result is None else result & found
+        return sorted(result or ())
+
+    def dump(self):
+        """Get a compact form of the index for the player.
+
+        Each token maps to a flat list of `frame, pane, row` triples.  Frames
+        are stored as the difference from the previous triple's frame.
+        """
+        out = {}
+        for token, postings in self.postings.items():
+            flat = []
+            last = 0
+            for n, pane, row in postings:
+                flat.extend((n - last, pane, row))
+                last = n
+            out[token] = flat
+        return out
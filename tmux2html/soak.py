@@ -0,0 +1,359 @@
+# coding: utf8
+"""Soak testing for long running recordings and streams.
+
+tmux2html is run against a fake `tmux` that simulates a window with panes
+producing output, resizing, and splitting.  The process is sampled while it
+runs and the results are checked against budgets:
+
+    python -m tmux2html.soak --mode record --duration 3600 --max-rss-mb 200
+
+The fake `tmux` derives the state of the window from the time since the soak
+started, so it doesn't need a server.  It logs its invocations, which is how
+ticks are measured: a tick starts when the window's layout is listed and
+ends with the last command before the next tick.  Linux only, since
+processes are sampled through `/proc`.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+
+
+words = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur',
+         'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor')
+
+
+class FakeWindow(object):
+    """The simulated window at a point in time."""
+
+    def __init__(self, config, t):
+        self.config = config
+        self.t = t
+        width = config['width']
+        height = config['height']
+        if config['resize_every']:
+            if int(t / config['resize_every']) % 2:
+                width -= 10
+                height -= 5
+        self.width = width
+        self.height = height
+
+        n = config['panes']
+        if config['split_every'] and int(t / config['split_every']) % 2:
+            n += 1
+
+        # Split horizontally with a column between each pane.
+        self.panes = []
+        x = 0
+        for i in range(n):
+            w = (width - (n - 1)) // n
+            if i == n - 1:
+                w = width - x
+            self.panes.append((i + 1, x, w))
+            x += w + 1
+
+    def layout(self):
+        if len(self.panes) == 1:
+            return 'abcd,{}x{},0,0,1'.format(self.width, self.height)
+        return 'abcd,{}x{},0,0{{{}}}'.format(
+            self.width, self.height, ','.join(
+                '{}x{},{},0,{}'.format(w, self.height, x, i)
+                for i, x, w in self.panes))
+
+    def pane(self, target):
+        identifier = int(target.lstrip('%'))
+        for p in self.panes:
+            if p[0] == identifier:
+                return p
+        return None
+
+    def line(self, identifier, n):
+        text = ' '.join(words[(n * 7 + i * identifier) % len(words)]
+                        for i in range(n % 9 + 1))
+        return '[{:06d}] \x1b[3{}m{}\x1b[0m {}'.format(
+            n, n % 8, words[n % len(words)], text)
+
+    def lines(self, identifier):
+        last = int(self.t * self.config['rate']) + identifier * 7
+        start = max(0, last - self.height)
+        return [self.line(identifier, n) for n in range(start, last)]
+
+
+def fake_tmux(state_dir, args):
+    """Respond to a tmux command like tmux would."""
+    with open(os.path.join(state_dir, 'config.json')) as fp:
+        config = json.load(fp)
+    now = time.time()
+    with open(os.path.join(state_dir, 'calls.log'), 'a') as fp:
+        fp.write('{:f} {}\n'.format(now, args[0] if args else ''))
+
+    window = FakeWindow(config, now - config['start'])
+    target = ''
+    if '-t' in args:
+        target = args[args.index('-t') + 1]
+
+    if not args:
+        return 1
+    elif args[0] == 'list-windows':
+        print('*,' + window.layout())
+    elif args[0] == 'display-message':
+        fmt = args[-1]
+        pane = window.pane(target)
+        if pane is None:
+            return 1
+        if 'scroll_position' in fmt:
+            print('/{}'.format(window.height - 1))
+        elif 'cursor_x' in fmt:
+            lines = window.lines(pane[0])
+            x = len(lines[-1]) % pane[2] if lines else 0
+            print('{},{},{},1'.format(int(pane[0] == 1), x,
+                                      len(lines) - 1))
+        elif 'pane_pipe' in fmt:
+            # Panes are only polled.
+            print('1')
+    elif args[0] == 'capture-pane':
+        pane = window.pane(target)
+        if pane is None:
+            return 1
+        for line in window.lines(pane[0]):
+            print(line)
+    return 0
+
+
+def rss(pid):
+    """Get the resident set size of a process in bytes."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return 0
+
+
+def children(pid):
+    """Count the child processes of a process."""
+    n = 0
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as fp:
+                stat = fp.read()
+        except IOError:
+            continue
+        # The command name can have spaces, but it's in parentheses.
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            n += 1
+    return n
+
+
+def percentile(values, p):
+    """Get a percentile with the nearest rank method."""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1,
+                              int(round(p / 100 * len(values))) - 1))]
+
+
+def ticks(log):
+    """Get the durations of ticks and the gaps between them from the log."""
+    calls = []
+    with open(log) as fp:
+        for line in fp:
+            t, cmd = line.split(' ', 1)
+            calls.append((float(t), cmd.strip()))
+
+    starts = [i for i, c in enumerate(calls) if c[1] == 'list-windows']
+    durations = []
+    gaps = []
+    for a, b in zip(starts, starts[1:]):
+        durations.append(calls[b - 1][0] - calls[a][0])
+        gaps.append(calls[b][0] - calls[a][0])
+    return durations, gaps, len(calls)
+
+
+def median(values):
+    return percentile(values, 50)
+
+
+def soak(args, extra):
+    tmpdir = tempfile.mkdtemp(prefix='tmux2html-soak.')
+    try:
+        return _soak(args, extra, tmpdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _soak(args, extra, tmpdir):
+    config = {
+        'start': time.time(),
+        'panes': args.panes,
+        'width': args.width,
+        'height': args.height,
+        'rate': args.rate,
+        'resize_every': args.resize_every,
+        'split_every': args.split_every,
+    }
+    with open(os.path.join(tmpdir, 'config.json'), 'w') as fp:
+        json.dump(config, fp)
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tmux = os.path.join(tmpdir, 'tmux')
+    with open(tmux, 'w') as fp:
+        fp.write('#!/bin/sh\nexec "{}" -m tmux2html.soak --fake-tmux "{}" '
+                 '"$@"\n'.format(sys.executable, tmpdir))
+    os.chmod(tmux, 0o755)
+
+    env = dict(os.environ)
+    env['PATH'] = tmpdir + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = package_dir + os.pathsep + env.get('PYTHONPATH', '')
+
+    output = args.output or os.path.join(tmpdir, 'soak.html')
+    cmd = [sys.executable, '-c', 'from tmux2html.main import main; main()',
+           '0', '-o', output, '--interval', str(args.interval)]
+    if args.mode == 'record':
+        cmd.extend(['--duration', str(args.duration)])
+    else:
+        cmd.append('--stream')
+    cmd.extend(extra)
+
+    print('Soaking {} for {:0.0f} seconds in {}'.format(
+        args.mode, args.duration, tmpdir))
+    log = open(os.path.join(tmpdir, 'tmux2html.log'), 'w')
+    proc = subprocess.Popen(cmd, env=env, stdout=log,
+                            stderr=subprocess.STDOUT)
+    start = time.time()
+    samples = []
+    stopping = False
+    try:
+        while proc.poll() is None:
+            elapsed = time.time() - start
+            if not stopping and elapsed > args.duration + args.grace:
+                # Stop streams, or recordings that overran.
+                proc.send_signal(signal.SIGINT)
+                stopping = True
+            size = 0
+            if os.path.exists(output):
+                size = os.path.getsize(output)
+            samples.append((elapsed, rss(proc.pid), children(proc.pid),
+                            size))
+            if not args.quiet:
+                print('{:8.1f}s  rss {:7.1f} MB  children {:2d}  '
+                      'output {:9.1f} KB'.format(
+                          elapsed, samples[-1][1] / 1048576, samples[-1][2],
+                          size / 1024))
+            time.sleep(args.sample)
+    except KeyboardInterrupt:
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+    log.close()
+
+    durations, gaps, calls = ticks(os.path.join(tmpdir, 'calls.log'))
+    elapsed = time.time() - start
+    rss_values = [x[1] for x in samples]
+    warm = [x[1] for x in samples if x[0] >= args.warmup]
+    q = max(1, len(warm) // 4)
+    growth = median(warm[-q:]) - median(warm[:q])
+    size = os.path.getsize(output) if os.path.exists(output) else 0
+
+    results = [
+        ('exit status', proc.returncode, None),
+        ('ticks', len(durations), None),
+        ('tmux calls/s', calls / elapsed, None),
+        ('tick p50 ms', percentile(durations, 50) * 1000, None),
+        ('tick p95 ms', percentile(durations, 95) * 1000, None),
+        ('tick p99 ms', percentile(durations, 99) * 1000, args.max_tick_ms),
+        ('tick gap p99 ms', percentile(gaps, 99) * 1000, None),
+        ('max rss MB', max(rss_values or [0]) / 1048576, args.max_rss_mb),
+        ('rss growth MB', growth / 1048576, args.max_rss_growth_mb),
+        ('max children', max([x[2] for x in samples] or [0]),
+         args.max_children),
+        ('output MB', size / 1048576, args.max_output_mb),
+    ]
+
+    failed = proc.returncode not in (0, -signal.SIGINT)
+    print()
+    for name, value, budget in results:
+        status = ''
+        if budget and value > budget:
+            status = '  FAIL (budget {})'.format(budget)
+            failed = True
+        print('{:<16} {:>10.2f}{}'.format(name, value, status))
+
+    if proc.returncode not in (0, -signal.SIGINT):
+        with open(os.path.join(tmpdir, 'tmux2html.log')) as fp:
+            print(fp.read())
+    return 1 if failed else 0
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--fake-tmux':
+        sys.exit(fake_tmux(sys.argv[2], sys.argv[3:]))
+
+    parser = argparse.ArgumentParser(
+        description='Soak test tmux2html against a fake tmux.  Arguments '
+        'after -- are passed to tmux2html.')
+    parser.add_argument('--mode', choices=('record', 'stream'),
+                        default='record', help='What to run')
+    parser.add_argument('--duration', default=60, type=float,
+                        help='Seconds to run for')
+    parser.add_argument('--interval', default=0.5, type=float,
+                        help='tmux2html\'s --interval')
+    parser.add_argument('--sample', default=1, type=float,
+                        help='Seconds between samples')
+    parser.add_argument('--grace', default=30, type=float,
+                        help='Seconds to wait for a recording to finish '
+                        'before it\'s stopped')
+    parser.add_argument('--panes', default=2, type=int,
+                        help='Number of panes to simulate')
+    parser.add_argument('--width', default=120, type=int,
+                        help='Width of the simulated window')
+    parser.add_argument('--height', default=40, type=int,
+                        help='Height of the simulated window')
+    parser.add_argument('--rate', default=10, type=float,
+                        help='Lines of output per second in each pane')
+    parser.add_argument('--resize-every', default=0, type=float,
+                        help='Seconds between window resizes')
+    parser.add_argument('--split-every', default=0, type=float,
+                        help='Seconds between adding or removing a pane')
+    parser.add_argument('--max-rss-mb', default=0, type=float,
+                        help='Budget for the maximum RSS')
+    parser.add_argument('--max-rss-growth-mb', default=0, type=float,
+                        help='Budget for RSS growth from the first to the '
+                        'last quarter of the run after --warmup')
+    parser.add_argument('--warmup', default=10, type=float,
+                        help='Seconds to ignore when measuring RSS growth')
+    parser.add_argument('--max-tick-ms', default=0, type=float,
+                        help='Budget for the 99th percentile tick duration')
+    parser.add_argument('--max-children', default=0, type=int,
+                        help='Budget for concurrent child processes')
+    parser.add_argument('--max-output-mb', default=0, type=float,
+                        help='Budget for the output size')
+    parser.add_argument('--output', default='',
+                        help='Keep the output at this path')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the temporary directory')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Only print the results')
+
+    argv = sys.argv[1:]
+    extra = []
+    if '--' in argv:
+        extra = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    sys.exit(soak(parser.parse_args(argv), extra))
+
+
+if __name__ == '__main__':
+    main()
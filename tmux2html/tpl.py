@@ -1,4 +1,6 @@
 import os
+import hashlib
+import tempfile
 from string import Template
 
 
@@ -18,5 +20,55 @@ def load(name):
     return _cache.get(name)
 
 
-def render(name, **kwargs):
-    return load(name).safe_substitute(**kwargs)
+def write_asset(name, directory, **kwargs):
+    """Render an asset template and write it to a content-hashed file.
+
+    The file name is derived from the content, so existing files are never
+    rewritten and can be cached indefinitely by browsers.  Returns the file
+    name.
+    """
+    data = load(name).safe_substitute(**kwargs).encode('utf8')
+    base, ext = os.path.splitext(name)
+    filename = 'tmux2html-{}.{}{}'.format(
+        base, hashlib.sha1(data).hexdigest()[:12], ext)
+    path = os.path.join(directory, filename)
+    if os.path.exists(path):
+        return filename
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp = tempfile.NamedTemporaryFile(prefix='tmp2html.', dir=directory,
+                                      delete=False)
+    try:
+        tmp.write(data)
+    finally:
+        tmp.close()
+    os.chmod(tmp.name, 0o0644)
+    os.rename(tmp.name, path)
+    return filename
+
+
+def render(name, assets=None, **kwargs):
+    """Render a template.
+
+    If `assets` is a `(directory, url)` tuple, the base stylesheet and the
+    template's script are written to `directory` and referenced from `url`
+    instead of being inlined.
+    """
+    if assets is None:
+        return load(name).safe_substitute(**kwargs)
+
+    directory, url = assets
+    if url and not url.endswith('/'):
+        url += '/'
+
+    base = os.path.splitext(name)[0]
+    stylesheet = url + write_asset('base.css', directory, **kwargs)
+    scripts = ''
+    if base != 'static':
+        scripts = '<script src="{}{}"></script>'.format(
+            url, write_asset(base + '.js', directory, **kwargs))
+
+    return load('external.html').safe_substitute(stylesheet=stylesheet,
+                                                 scripts=scripts, **kwargs)
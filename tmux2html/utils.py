@@ -6,14 +6,14 @@ import sys
 import gzip
 import subprocess
 import unicodedata
-from base64 import b64encode
+from base64 import b64encode, b64decode
 
 from . import tmux_layout
 
 
 def compress_data(s, line_len=200):
     b = io.BytesIO()
-    with gzip.GzipFile(fileobj=b, mode='w') as fp:
+    with gzip.GzipFile(fileobj=b, mode='w', mtime=0) as fp:
         fp.write(s.encode('utf8'))
     hunks = []
     data = b64encode(b.getvalue()).decode('utf8')
@@ -22,6 +22,13 @@ def compress_data(s, line_len=200):
     return hunks
 
 
+def decompress_data(s):
+    """Get the text of data from `compress_data()`."""
+    b = io.BytesIO(b64decode(s))
+    with gzip.GzipFile(fileobj=b, mode='r') as fp:
+        return fp.read().decode('utf8')
+
+
 def shell_cmd(cmd, ignore_error=False):
     """Execute a command.
 
@@ -73,15 +80,20 @@ def get_contents(target, full=False, max_lines=0):
 
 
 def get_cursor(target):
+    """Get the cursor position of a pane.
+
+    Returns (-1, -1) if the pane isn't active or the cursor is hidden.
+    """
     cmd = ['tmux', 'display-message', '-p', '-t', str(target),
-           '#{pane_active},#{cursor_x},#{cursor_y}']
+           '#{pane_active},#{cursor_x},#{cursor_y},#{cursor_flag}']
     output = shell_cmd(cmd, ignore_error=True)
     try:
-        output = [int(x) for x in output.split(',')]
+        active, x, y, visible = output.strip().split(',')
+        output = [int(active), int(x), int(y)]
     except ValueError:
         print(cmd, output)
         return (-1, -1)
-    if output[0]:
+    if output[0] and visible != '0':
         return [x for x in output[1:]]
     return (-1, -1)
 
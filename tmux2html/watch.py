@@ -0,0 +1,160 @@
+# coding: utf8
+"""Pane output watching.
+
+Output from each pane is piped into a FIFO using `tmux pipe-pane`.  The data
+itself is discarded.  It's only used as a signal that the pane needs to be
+captured again.
+"""
+from __future__ import print_function, division
+
+import os
+import errno
+import select
+import shutil
+import tempfile
+
+from . import utils
+from .schedule import monotonic
+
+
+class PaneWatcher(object):
+    """Watches panes for output.
+
+    Output is coalesced: a capture is due once a pane has been quiet for
+    `debounce` seconds, or `max_latency` seconds after its first unhandled
+    output, whichever comes first.  All panes with pending output are handed
+    out together so they can be captured in the same tick.
+    """
+
+    def __init__(self, debounce=0.05, max_latency=0.5):
+        self.debounce = debounce
+        self.max_latency = max(debounce, max_latency)
+        self.tmpdir = tempfile.mkdtemp(prefix='tmux2html.')
+        self.fifos = {}
+        self.panes = frozenset()
+        self.first_output = {}
+        self.last_output = {}
+
+    def _fifo_path(self, identifier):
+        return os.path.join(self.tmpdir, str(identifier))
+
+    def _open(self, identifier):
+        fd = os.open(self._fifo_path(identifier),
+                     os.O_RDONLY | os.O_NONBLOCK)
+        self.fifos[identifier] = fd
+        return fd
+
+    def attach(self, identifiers):
+        """Watch the panes in `identifiers` and stop watching the rest.
+
+        Panes that already have a pipe open are left alone since tmux only
+        allows one pipe per pane.  They're still captured when polling.  The
+        panes are only checked when they're different from the last call's,
+        so this is cheap to call on every tick.
+        """
+        identifiers = frozenset(identifiers)
+        if identifiers == self.panes:
+            return
+        self.panes = identifiers
+        for identifier in list(self.fifos):
+            if identifier not in identifiers:
+                self.detach(identifier)
+
+        for identifier in identifiers:
+            if identifier in self.fifos:
+                continue
+            target = '%{}'.format(identifier)
+            piped = utils.shell_cmd(['tmux', 'display-message', '-p', '-t',
+                                     target, '#{pane_pipe}'],
+                                    ignore_error=True)
+            if piped.strip() == '1':
+                continue
+            path = self._fifo_path(identifier)
+            os.mkfifo(path, 0o600)
+            self._open(identifier)
+            utils.shell_cmd(['tmux', 'pipe-pane', '-t', target,
+                             'exec cat >> {}'.format(path)],
+                            ignore_error=True)
+
+    def detach(self, identifier):
+        """Stop watching a pane."""
+        fd = self.fifos.pop(identifier, None)
+        if fd is None:
+            return
+        utils.shell_cmd(['tmux', 'pipe-pane', '-t', '%{}'.format(identifier)],
+                        ignore_error=True)
+        os.close(fd)
+        try:
+            os.unlink(self._fifo_path(identifier))
+        except OSError:
+            pass
+        self.first_output.pop(identifier, None)
+        self.last_output.pop(identifier, None)
+
+    def close(self):
+        """Stop watching all panes and remove the FIFOs."""
+        for identifier in list(self.fifos):
+            self.detach(identifier)
+        self.panes = frozenset()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _drain(self, identifier, now):
+        fd = self.fifos[identifier]
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                # The writer went away.  Reopen so the closed FIFO isn't
+                # reported as readable forever.
+                os.close(fd)
+                fd = self._open(identifier)
+                break
+            self.first_output.setdefault(identifier, now)
+            self.last_output[identifier] = now
+
+    def _due(self, now):
+        """Get the time the pending output is due, or None."""
+        due = None
+        for identifier, first in self.first_output.items():
+            t = min(first + self.max_latency,
+                    self.last_output[identifier] + self.debounce)
+            if due is None or t < due:
+                due = t
+        return due
+
+    def wait(self, timeout):
+        """Wait for pane output.
+
+        Returns a dict of pane identifiers mapped to the monotonic time of
+        their first output since the last batch.  The dict is empty if
+        `timeout` elapsed without any output becoming due.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            now = monotonic()
+            due = self._due(now)
+            if due is not None and due <= now:
+                batch = self.first_output
+                self.first_output = {}
+                self.last_output = {}
+                return batch
+
+            if now >= deadline:
+                return {}
+
+            wake = deadline if due is None else min(due, deadline)
+            fds = dict((fd, i) for i, fd in self.fifos.items())
+            try:
+                readable = select.select(list(fds), [], [], wake - now)[0]
+            except (select.error, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            now = monotonic()
+            for fd in readable:
+                self._drain(fds[fd], now)